@@ -0,0 +1,127 @@
+"""
+this script benchmarks loading the catalog from ntrip-catalog.json
+and from its compact artifacts
+"""
+
+import argparse
+import json
+import marshal
+import os
+import pathlib
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from benchmarks import timing  # noqa: E402
+from scripts import make_dist  # noqa: E402
+from scripts import query as ntrip_query  # noqa: E402
+
+
+def scaled_catalog(data, scale):
+    """Returns data with its entries repeated `scale` times, with unique urls."""
+    entries = []
+    for i in range(scale):
+        for entry in data["entries"]:
+            urls = [url.replace("://", f"://s{i}.", 1) for url in entry["urls"]]
+            entries.append({**entry, "name": f"{entry['name']} {i}", "urls": urls})
+    return {**data, "entries": entries}
+
+
+def measure(load, repeat):
+    """timing.measure of load, and the memory of what it returns."""
+    results = timing.measure(load, repeat)
+    tracemalloc.start()
+    loaded = load()  # noqa: F841 keep it alive to measure it
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results["retained_bytes"] = retained
+    results["peak_bytes"] = peak
+    return results
+
+
+def run(json_path, scale, repeat):
+    data = ntrip_query.load_json(json_path, compact=False)
+    if scale > 1:
+        data = scaled_catalog(data, scale)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ntrip-catalog.json")
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
+        make_dist.write_compact(data, path)
+        min_json_path, snapshot_path = ntrip_query.compact_paths(path)
+
+        def load_full():
+            return ntrip_query.load_json(path, compact=False)
+
+        def load_min_json():
+            with open(min_json_path) as f:
+                return json.load(f)
+
+        def load_snapshot():
+            with open(snapshot_path, "rb") as f:
+                return marshal.loads(f.read())
+
+        results = {
+            "entries": len(data["entries"]),
+            "sizes": {
+                "full_json": os.path.getsize(path),
+                "min_json": os.path.getsize(min_json_path),
+                "snapshot": os.path.getsize(snapshot_path),
+            },
+            "load": {
+                "full_json": measure(load_full, repeat),
+                "min_json": measure(load_min_json, repeat),
+                "snapshot": measure(load_snapshot, repeat),
+                "load_json": measure(
+                    lambda: ntrip_query.load_json(path, compact=True), repeat
+                ),
+            },
+            "catalog": {
+                "full_json": measure(lambda: ntrip_query.Catalog(load_full()), repeat),
+                "compact": measure(
+                    lambda: ntrip_query.Catalog.from_file(path, compact=True), repeat
+                ),
+            },
+        }
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark loading the full and the compact catalog."
+    )
+
+    parser.add_argument(
+        "--json-path",
+        type=str,
+        help="Location of ntrip-catalog.json. Defaults to ../dist/ntrip-catalog.json",
+    )
+    parser.add_argument(
+        "--scale",
+        type=int,
+        help="Repeat the entries this number of times, to emulate a larger catalog",
+        default=1,
+    )
+    parser.add_argument("--repeat", type=int, help="Timed repetitions", default=20)
+    parser.add_argument("--output", type=str, help="Write the results to this file")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    json_path = args.json_path or str(
+        pathlib.Path(ntrip_query.local_path) / "dist" / "ntrip-catalog.json"
+    )
+    results = run(json_path, args.scale, args.repeat)
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
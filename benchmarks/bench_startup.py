@@ -0,0 +1,145 @@
+"""
+this script benchmarks the start time of a query.py run that needs no network,
+and fails if it is over a budget
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from benchmarks.timing import measure  # noqa: E402
+from scripts import query as ntrip_query  # noqa: E402
+
+# modules that query.py imports only when they are used
+HEAVY_MODULES = ["numpy", "pycurl"]
+
+
+def wall_time(command, repeat):
+    """Returns the best and median seconds of running command."""
+    return measure(
+        lambda: subprocess.run(
+            command,
+            cwd=ntrip_query.local_path,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ),
+        repeat,
+    )
+
+
+def imported_modules(command):
+    """Returns the HEAVY_MODULES imported by command, from -X importtime."""
+    output = subprocess.run(
+        [command[0], "-X", "importtime"] + command[1:],
+        cwd=ntrip_query.local_path,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    imported = {line.rsplit("|", 1)[-1].strip() for line in output.splitlines()}
+    return [module for module in HEAVY_MODULES if module in imported]
+
+
+def query_args(tmp, json_path):
+    """
+    Returns the arguments of a query of the first entry, with a sourcetable
+    file in tmp, so that nothing is fetched. The dist is used as make_dist
+    wrote it: its compact artifacts and shards are used only if it wrote them.
+    """
+    data = ntrip_query.load_json(json_path, compact=False)
+    sourcetable_path = os.path.join(tmp, "sourcetable.txt")
+    with open(sourcetable_path, "w") as f:
+        f.write(
+            "STR;MP;MP;RTCM 3.2;;2;GPS;NET;ESP;40.42;-3.70;1;0;sNTRIP;none;B;N;0;\n"
+        )
+    url = data["entries"][0]["urls"][0]
+    return [
+        "--json-path",
+        json_path,
+        "--url",
+        url,
+        "--mountpoint",
+        "MP",
+        "--rover-lat",
+        "40.4",
+        "--rover-lon",
+        "-3.7",
+        "--rover-country",
+        "ESP",
+        "--sourcetable",
+        sourcetable_path,
+    ]
+
+
+def run(json_path, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        args = query_args(tmp, json_path)
+        commands = {
+            "interpreter": [sys.executable, "-c", "pass"],
+            "import": [sys.executable, "-c", "import scripts.query"],
+            "query_script": [sys.executable, "scripts/query.py"] + args,
+            "query_module": [sys.executable, "-m", "scripts.query"] + args,
+        }
+        results = {
+            name: wall_time(command, repeat) for name, command in commands.items()
+        }
+        heavy = imported_modules(commands["query_script"])
+    interpreter = results["interpreter"]["median_s"]
+    for result in results.values():
+        result["overhead_s"] = result["median_s"] - interpreter
+    return {"results": results, "heavy_imports": heavy}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the start time of query.py without network access."
+    )
+
+    parser.add_argument(
+        "--json-path",
+        type=str,
+        help="Location of ntrip-catalog.json. Defaults to ../dist/ntrip-catalog.json",
+    )
+    parser.add_argument("--repeat", type=int, help="Timed repetitions", default=10)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        help=(
+            "Maximum median time of query.py over the bare interpreter start."
+            " Fails if it is over, or if it imports numpy or pycurl"
+        ),
+        # medians of 138 to 183 ms were measured on the dist that make_dist
+        # writes by default, so the budget leaves room for the runner noise
+        default=250,
+    )
+    parser.add_argument("--output", type=str, help="Write the results to this file")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    json_path = args.json_path or os.path.join(
+        ntrip_query.local_path, "dist", "ntrip-catalog.json"
+    )
+    results = run(json_path, args.repeat)
+    overhead_ms = results["results"]["query_script"]["overhead_s"] * 1000
+    results["budget_ms"] = args.budget_ms
+    results["ok"] = overhead_ms <= args.budget_ms and not results["heavy_imports"]
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if not results["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+this script benchmarks the hot paths of the scripts on synthetic data,
+and writes the timings as json to compare them between commits
+"""
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from benchmarks import synthetic  # noqa: E402
+from benchmarks.timing import measure  # noqa: E402
+from scripts import make_dist  # noqa: E402
+from scripts import validator  # noqa: E402
+from scripts import query as ntrip_query  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def benchmarks(tmp, n_entries, n_lines):
+    """Yields (name, function, number of calls per run) of each benchmark."""
+    catalog = synthetic.synthetic_catalog(n_entries)
+    lines = synthetic.synthetic_sourcetable(n_lines)
+    json_path = os.path.join(tmp, "ntrip-catalog.json")
+    with open(json_path, "w") as f:
+        json.dump(catalog, f, indent=4)
+    compact_path = os.path.join(tmp, "compact", "ntrip-catalog.json")
+    os.makedirs(os.path.dirname(compact_path))
+    with open(compact_path, "w") as f:
+        json.dump(catalog, f, indent=4)
+    make_dist.write_compact(catalog, compact_path)
+    data_dir = os.path.join(tmp, "data")
+    synthetic.write_data_tree(catalog, data_dir)
+
+    data = ntrip_query.load_json(json_path, compact=False)
+    indexed = ntrip_query.Catalog(data)
+    # urls all along the catalog, and one missing
+    urls = [entry["urls"][0] for entry in data["entries"][:: max(1, n_entries // 20)]]
+    urls.append("http://missing.example.com:2101")
+    mountpoints = [f"MP{i}" for i in range(0, n_lines, max(1, n_lines // 20))]
+    mountpoints.append("MISSING")
+    sourcetable = ntrip_query.Sourcetable(lines)
+    entries = [indexed.search_url(url) for url in urls[:-1]]
+    resolvers = [indexed.resolver(url) for url in urls[:-1]]
+
+    def filter_all(sourcetable):
+        for entry, mountpoint in zip(entries, mountpoints):
+            ntrip_query.filter_crs(
+                entry, entry["urls"][0], mountpoint, 40, -3, "ESP", sourcetable
+            )
+
+    def resolve_all(sourcetable):
+        for resolver, url, mountpoint in zip(resolvers, urls, mountpoints):
+            resolver.resolve(url, mountpoint, 40, -3, "ESP", sourcetable)
+
+    schema = validator.get_entries_schema("v0.2")
+    schemas_uri = pathlib.Path(validator.get_schemas_path("v0.2")).as_uri() + "/"
+
+    yield "load_json", lambda: ntrip_query.load_json(json_path, compact=False), 1
+    yield "load_json_compact", lambda: ntrip_query.load_json(
+        compact_path, compact=True
+    ), 1
+    yield "catalog_init", lambda: ntrip_query.Catalog(data), 1
+    yield "search_url_in_data", lambda: [
+        ntrip_query.search_url_in_data(url, data) for url in urls
+    ], 1
+    yield "catalog_search_url", lambda: [indexed.search_url(url) for url in urls], 100
+    yield "get_str_line_from_server", lambda: [
+        ntrip_query.get_str_line_from_server(lines, mp) for mp in mountpoints
+    ], 1
+    yield "sourcetable_init", lambda: ntrip_query.Sourcetable(lines), 1
+    yield "sourcetable_get", lambda: [sourcetable.get(mp) for mp in mountpoints], 1000
+    yield "filter_crs_lines", lambda: filter_all(lines), 1
+    yield "filter_crs_sourcetable", lambda: filter_all(sourcetable), 1
+    yield "compile_entries", lambda: [ntrip_query.compile_entry(e) for e in entries], 1
+    yield "resolver_resolve", lambda: resolve_all(sourcetable), 1
+    yield "resolve_all_mountpoints", lambda: ntrip_query.resolve_all_mountpoints(
+        entries[0], urls[0], sourcetable
+    ), 1
+    yield "make_dist_read_json", lambda: make_dist.read_json(data_dir, False), 1
+    yield "validate_jsons", lambda: validator.validate_jsons(
+        data_dir, False, schema, False, schemas_uri
+    ), 1
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ntrip_query.local_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(n_entries, n_lines, repeat, only=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, func, number in benchmarks(tmp, n_entries, n_lines):
+            if only and name not in only:
+                continue
+            logger.info(f"running {name}")
+            results[name] = measure(func, repeat, number)
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "entries": n_entries,
+            "str_lines": n_lines,
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Logs the ratio against the baseline. Returns False if any is too slow."""
+    ok = True
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        ratio = result["median_s"] / baseline["results"][name]["median_s"]
+        if ratio > tolerance:
+            ok = False
+            logger.error(f"{name}: {ratio:.2f}x slower than the baseline")
+        else:
+            logger.info(f"{name}: {ratio:.2f}x the baseline")
+    return ok
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scripts with a synthetic catalog and sourcetable."
+    )
+
+    parser.add_argument(
+        "--entries", type=int, help="Entries of the catalog", default=10000
+    )
+    parser.add_argument(
+        "--str-lines", type=int, help="STR lines of the sourcetable", default=100000
+    )
+    parser.add_argument("--repeat", type=int, help="Timed repetitions", default=3)
+    parser.add_argument("--only", type=str, nargs="*", help="Run only these benchmarks")
+    parser.add_argument("--output", type=str, help="Write the results to this file")
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="Results of a previous run to compare with. Fails if any is slower",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="Allowed ratio of the median against the baseline",
+        default=1.5,
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    results = run(args.entries, args.str_lines, args.repeat, args.only)
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+generators of synthetic catalogs and sourcetables, for the benchmarks
+"""
+
+import json
+import os
+import random
+
+COUNTRIES = ["AUS", "BRA", "CAN", "CHE", "DEU", "ESP", "FRA", "ITA", "JPN", "USA"]
+CRSS = [
+    ("EPSG:7912", "ITRF2014"),
+    ("EPSG:7931", "ETRF2000"),
+    ("EPSG:6319", "NAD83(2011)"),
+    ("EPSG:6667", "JGD2011"),
+    ("EPSG:4080", "REGCAN95"),
+]
+
+
+def _bbox(rng):
+    west = round(rng.uniform(-180, 180), 2)
+    south = round(rng.uniform(-80, 70), 2)
+    east = round(west + rng.uniform(1, 40), 2)
+    if east > 180:
+        east = round(east - 360, 2)  # crossing the antimeridian
+    north = round(min(90, south + rng.uniform(1, 20)), 2)
+    return [west, south, east, north]
+
+
+def _crss(rng):
+    crss = []
+    for _ in range(rng.randint(0, 2)):
+        crs_id, name = rng.choice(CRSS)
+        if rng.random() < 0.5:
+            crss.append({"id": crs_id, "name": name, "rover_bbox": _bbox(rng)})
+        else:
+            countries = rng.sample(COUNTRIES, 2)
+            crss.append({"id": crs_id, "name": name, "rover_countries": countries})
+    crs_id, name = rng.choice(CRSS)
+    crss.append({"id": crs_id, "name": name, "description": "default"})
+    return crss
+
+
+def synthetic_entry(i, rng, n_mountpoints=100):
+    """
+    Returns a valid entry, with streams filtered by mountpoints, countries,
+    lat_lon_bboxes and all, in random order. Mountpoints are named MP<n>, as in
+    synthetic_sourcetable.
+    """
+    filters = [
+        {"mountpoints": [f"MP{rng.randrange(n_mountpoints)}" for _ in range(10)]},
+        {"countries": rng.sample(COUNTRIES, 3)},
+        {"lat_lon_bboxes": [_bbox(rng) for _ in range(rng.randint(1, 3))]},
+    ]
+    rng.shuffle(filters)
+    if rng.random() < 0.5:
+        filters.append("all")
+    return {
+        "name": f"Synthetic {i:06d}",
+        "description": f"Synthetic NTRIP service number {i}",
+        "urls": [
+            f"http://caster{i}.example.com:2101",
+            f"https://caster{i}.example.com:443",
+        ],
+        "reference": {"url": f"https://caster{i}.example.com/crs"},
+        "last_update": "2025-01-01",
+        "streams": [{"filter": f, "crss": _crss(rng)} for f in filters],
+    }
+
+
+def synthetic_catalog(n_entries=10000, seed=0, release=1):
+    rng = random.Random(seed)
+    return {
+        "$schema": "https://ntrip-catalog.org/schemas/v0.2/ntrip-catalog.schema.json",
+        "release": release,
+        "comment": "Synthetic catalog for benchmarks.",
+        "entries": [synthetic_entry(i, rng) for i in range(n_entries)],
+    }
+
+
+def synthetic_sourcetable(n_lines=100000, seed=0):
+    """Returns the lines of a sourcetable with n_lines STR lines MP0, MP1, ..."""
+    rng = random.Random(seed)
+    lines = [
+        "CAS;caster.example.com;2101;Synthetic;Example;0;ESP;40.00;-3.00;0.0.0.0;0;",
+        "NET;SYN;Example;B;N;https://example.com;none;none;none;",
+    ]
+    for i in range(n_lines):
+        country = rng.choice(COUNTRIES)
+        lat = rng.uniform(-80, 80)
+        lon = rng.uniform(-180, 180)
+        lines.append(
+            f"STR;MP{i};Station {i};RTCM 3.2;1004(1),1006(10);2;GPS+GLO;SYN;"
+            f"{country};{lat:.2f};{lon:.2f};1;0;sNTRIP;none;B;N;2400;"
+        )
+    lines.append("ENDSOURCETABLE")
+    return lines
+
+
+def write_data_tree(catalog, directory, entries_per_file=10, files_per_folder=100):
+    """Writes the entries of catalog as a data tree, like the data folder."""
+    entries = catalog["entries"]
+    for n, start in enumerate(range(0, len(entries), entries_per_file)):
+        folder = os.path.join(directory, f"folder{n // files_per_folder:04d}")
+        os.makedirs(folder, exist_ok=True)
+        end = start + entries_per_file
+        with open(os.path.join(folder, f"file{n:06d}.json"), "w") as f:
+            json.dump(entries[start:end], f, indent=4)
+    with open(os.path.join(directory, "release.txt"), "w") as f:
+        f.write(f"{catalog['release']}\n")
@@ -0,0 +1,28 @@
+"""
+timing helper shared by the benchmark scripts
+"""
+
+import gc
+import statistics
+import time
+
+
+def measure(func, repeat, number=1):
+    """Returns the best and median seconds of a call, of `repeat` runs."""
+    times = []
+    gc.collect()
+    gc.disable()  # as timeit does
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            times.append((time.perf_counter() - start) / number)
+    finally:
+        gc.enable()
+    return {
+        "best_s": min(times),
+        "median_s": statistics.median(times),
+        "repeat": repeat,
+        "number": number,
+    }
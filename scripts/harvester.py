@@ -0,0 +1,195 @@
+"""
+this script fetches the sourcetables of many NTRIP servers concurrently
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque, namedtuple
+from io import BytesIO
+from urllib.parse import urlparse
+
+import pycurl
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from scripts import query as ntrip_query  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+HarvestResult = namedtuple("HarvestResult", ["url", "lines", "error", "elapsed"])
+
+
+class _Transfer:
+    def __init__(self, url, host):
+        self.url = url
+        self.host = host
+        self.buffer = BytesIO()
+        self.start = time.monotonic()
+
+
+def harvest(urls, max_parallel=16, max_per_host=2):
+    """
+    Fetches the sourcetables of urls concurrently, using pycurl.CurlMulti.
+
+    At most `max_parallel` transfers run at the same time, and at most
+    `max_per_host` to the same hostname. The connect and total timeouts of
+    get_streams_from_server apply to each transfer.
+    Returns a dict url -> HarvestResult, with either the sourcetable lines or
+    the error, and the elapsed seconds of the transfer.
+    """
+    pending = deque(dict.fromkeys(urls))
+    results = {}
+    active = {}  # curl -> _Transfer
+    active_per_host = {}
+    handles = []
+    multi = pycurl.CurlMulti()
+
+    def start_transfers():
+        waiting = []
+        while pending and len(active) < max_parallel:
+            url = pending.popleft()
+            host = urlparse(url).hostname
+            if not host:
+                error = ValueError(f"{url} is not a valid URL")
+                results[url] = HarvestResult(url, None, error, 0.0)
+                continue
+            if active_per_host.get(host, 0) >= max_per_host:
+                waiting.append(url)
+                continue
+            transfer = _Transfer(url, host)
+            curl = handles.pop() if handles else pycurl.Curl()
+            ntrip_query.setup_curl(curl, url, transfer.buffer.write)
+            multi.add_handle(curl)
+            active[curl] = transfer
+            active_per_host[host] = active_per_host.get(host, 0) + 1
+        pending.extendleft(reversed(waiting))
+
+    def finish_transfer(curl, error):
+        multi.remove_handle(curl)
+        transfer = active.pop(curl)
+        active_per_host[transfer.host] -= 1
+        elapsed = time.monotonic() - transfer.start
+        lines = None
+        if error is None:
+            lines = ntrip_query.decode_sourcetable(transfer.buffer.getvalue())
+        else:
+            logger.debug(f"{transfer.url} failed: {error}")
+        results[transfer.url] = HarvestResult(transfer.url, lines, error, elapsed)
+        curl.reset()
+        handles.append(curl)
+
+    try:
+        start_transfers()
+        while active:
+            while True:
+                ret, _ = multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            while True:
+                queued, ok_list, error_list = multi.info_read()
+                for curl in ok_list:
+                    finish_transfer(curl, None)
+                for curl, errno, errmsg in error_list:
+                    finish_transfer(curl, pycurl.error(errno, errmsg))
+                if not queued:
+                    break
+            start_transfers()
+            if active:
+                multi.select(1.0)
+    finally:
+        for curl in active:
+            multi.remove_handle(curl)
+        for curl in [*active, *handles]:
+            curl.close()
+        multi.close()
+    return results
+
+
+def harvest_catalog(catalog, **kwargs):
+    """harvest the sourcetables of all the URLs in a Catalog."""
+    urls = [url for entry in catalog.entries for url in entry["urls"]]
+    return harvest(urls, **kwargs)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Fetch the sourcetables of many NTRIP servers concurrently."
+    )
+
+    parser.add_argument(
+        "--urls",
+        type=str,
+        nargs="*",
+        help="URLs of the NTRIP servers. Defaults to all the URLs in the catalog",
+    )
+    parser.add_argument(
+        "--json-path",
+        type=str,
+        help="Location of ntrip-catalog.json. Defaults to ../dist/ntrip-catalog.json",
+    )
+    parser.add_argument(
+        "--max-parallel",
+        type=int,
+        help="Maximum number of concurrent transfers",
+        default=16,
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=int,
+        help="Maximum number of concurrent transfers to the same host",
+        default=2,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Write the sourcetables, errors and timings to this json file",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    start = time.monotonic()
+    if args.urls:
+        urls = [ntrip_query.normalize_url(url) for url in args.urls]
+        results = harvest(urls, args.max_parallel, args.max_per_host)
+    else:
+        catalog = ntrip_query.get_catalog(args.json_path)
+        results = harvest_catalog(
+            catalog, max_parallel=args.max_parallel, max_per_host=args.max_per_host
+        )
+
+    for result in results.values():
+        if result.error:
+            logger.warning(
+                f"{result.url} FAILED in {result.elapsed:.2f}s: {result.error}"
+            )
+        else:
+            n_str = sum(line.startswith("STR;") for line in result.lines)
+            logger.info(f"{result.url} OK in {result.elapsed:.2f}s, {n_str} STR")
+    failed = sum(result.error is not None for result in results.values())
+    logger.info(
+        f"{len(results)} URLs, {failed} failed," f" in {time.monotonic() - start:.2f}s"
+    )
+
+    if args.output:
+        output = {
+            result.url: {
+                "lines": result.lines,
+                "error": str(result.error) if result.error else None,
+                "elapsed": result.elapsed,
+            }
+            for result in results.values()
+        }
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=4)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,44 +3,155 @@ this script generates a single json from collecting all the json in a tree
 """
 
 import argparse
+import hashlib
 import json
 import logging
+import marshal
 import os
 import pathlib
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
 
 local_path = pathlib.Path(__file__).parent.parent.resolve().as_posix()
 
 logger = logging.getLogger(__name__)
 
+MANIFEST_VERSION = 1
+# below this number of changed files, a process pool costs more than it saves
+PARALLEL_THRESHOLD = 32
 
-def read_json(input, log_input_files):
-    if not input:
-        input = os.path.join(local_path, "data")
+# Keys that are not used to resolve a CRS, removed from the compact artifacts
+UNRESOLVED_KEYS = {
+    "$schema",
+    "comment",
+    "comments",
+    "description",
+    "last_update",
+    "reference",
+}
+# The compact artifacts and the shards are read by query.py. These must match
+# query.SNAPSHOT_VERSION, query.compact_paths, query.source_stamp and
+# query.normalize_url, that are not imported to keep query.py out of make_dist.
+SNAPSHOT_VERSION = 1
 
-    entries = []
-
-    walk_dir = os.path.abspath(input)
-    logger.debug("walk_dir (absolute) = " + walk_dir)
 
+def _json_files(walk_dir, log_input_files):
+    res = []
     for root, subdirs, files in os.walk(walk_dir):
         for filename in files:
             file_path = os.path.join(root, filename)
             extension = pathlib.Path(file_path).suffix
             if extension == ".json":
-                if log_input_files:
-                    logger.info(f"{file_path}")
-                with open(file_path) as f:
-                    content = json.load(f)
-                    if isinstance(content, list):
-                        entries += content
-                    elif isinstance(content, dict):
-                        entries += [content]
-                    else:
-                        raise Exception(
-                            f"Unexpected content type in json file ${file_path}"
-                        )
+                res.append(file_path)
             elif log_input_files and filename != "release.txt":
                 logger.warning(f"file {file_path} is not JSON")
+    return res
+
+
+def _entries_from_content(content, file_path):
+    if isinstance(content, list):
+        return content
+    elif isinstance(content, dict):
+        return [content]
+    else:
+        raise Exception(f"Unexpected content type in json file ${file_path}")
+
+
+def _parse_file(file_path, known_sha256=None):
+    """Returns the content hash, and the entries if the hash is not known_sha256"""
+    with open(file_path, "rb") as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    if sha256 == known_sha256:
+        return sha256, None
+    return sha256, _entries_from_content(json.loads(data), file_path)
+
+
+def _load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+
+def _save_manifest(manifest_path, files):
+    directory = pathlib.Path(manifest_path).parent
+    directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, f)
+    os.replace(f.name, manifest_path)
+
+
+def _read_entries_incremental(file_paths, walk_dir, manifest_path, jobs):
+    """
+    Returns the entries of each file, in order, reusing the ones cached in the
+    manifest for the files whose size and mtime, or else content hash, did not
+    change. The changed files are parsed in a process pool if there are many.
+    """
+    cached = _load_manifest(manifest_path)
+    files = {}
+    to_parse = []
+    for file_path in file_paths:
+        key = os.path.relpath(file_path, walk_dir)
+        stat = os.stat(file_path)
+        record = cached.get(key)
+        if record and record["stat"] == [stat.st_mtime_ns, stat.st_size]:
+            files[key] = record
+        else:
+            files[key] = {"stat": [stat.st_mtime_ns, stat.st_size]}
+            to_parse.append((key, file_path, record))
+
+    paths = [file_path for _, file_path, _ in to_parse]
+    known = [record and record["sha256"] for _, _, record in to_parse]
+    if len(to_parse) >= PARALLEL_THRESHOLD and jobs != 1:
+        with ProcessPoolExecutor(jobs) as executor:
+            parsed = list(executor.map(_parse_file, paths, known))
+    else:
+        parsed = list(map(_parse_file, paths, known))
+
+    for (key, file_path, record), (sha256, entries) in zip(to_parse, parsed):
+        files[key]["sha256"] = sha256
+        files[key]["entries"] = record["entries"] if entries is None else entries
+
+    logger.debug(f"{len(to_parse)} of {len(file_paths)} json files parsed")
+    _save_manifest(manifest_path, files)
+    return [files[os.path.relpath(p, walk_dir)]["entries"] for p in file_paths]
+
+
+def read_json(input, log_input_files, manifest_path=None, jobs=None):
+    """
+    Collects the entries of all the json files in the input tree.
+    With a manifest_path, only the files changed since the previous run are
+    parsed. The result is identical to a full read.
+    """
+    if not input:
+        input = os.path.join(local_path, "data")
+
+    entries = []
+
+    walk_dir = os.path.abspath(input)
+    logger.debug("walk_dir (absolute) = " + walk_dir)
+
+    file_paths = _json_files(walk_dir, log_input_files)
+    if log_input_files:
+        for file_path in file_paths:
+            logger.info(f"{file_path}")
+
+    if manifest_path:
+        for file_entries in _read_entries_incremental(
+            file_paths, walk_dir, manifest_path, jobs
+        ):
+            entries += file_entries
+    else:
+        for file_path in file_paths:
+            with open(file_path) as f:
+                entries += _entries_from_content(json.load(f), file_path)
 
     entries.sort(key=lambda x: x["name"] + "  " + "".join(x["urls"]))
 
@@ -66,6 +177,132 @@ def read_json(input, log_input_files):
     return final
 
 
+def compact_paths(json_path):
+    """Returns the paths of the minified json and binary snapshot of json_path."""
+    base = os.path.splitext(json_path)[0]
+    return base + ".min.json", base + ".snapshot"
+
+
+def source_stamp(json_path):
+    """Returns [size, mtime in ns] of json_path, recorded in its derived artifacts."""
+    stat = os.stat(json_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def normalize_url(url, port=None):
+    """
+    Returns the catalog form "scheme://hostname:port" of url.
+    The scheme defaults to http, and the port to `port` or 2101.
+    """
+    if "://" not in url:
+        url = "http://" + url
+    parsed = urlparse(url)
+    hostname = parsed.hostname
+    if not hostname:
+        raise ValueError(f"{url} is not a valid URL")
+    if ":" in hostname:
+        hostname = f"[{hostname}]"  # IPv6
+    port = parsed.port or port or 2101
+    return parsed.scheme.lower() + "://" + hostname + ":" + str(port)
+
+
+def _normalize_lon(lon):
+    while lon > 180:
+        lon -= 360
+    while lon < -180:
+        lon += 360
+    return lon
+
+
+def compact_catalog(data):
+    """
+    Returns the catalog with only the data needed to resolve a CRS:
+    without the descriptions, references and comments of the entries and
+    streams, with normalized stream bboxes, and with the URL lookup table
+    under "urls". The CRSs are kept as they are, as they are the result of
+    a query.
+    """
+
+    def strip(obj):
+        return {k: v for k, v in obj.items() if k not in UNRESOLVED_KEYS}
+
+    entries = []
+    urls = {}
+    for i, entry in enumerate(data["entries"]):
+        streams = []
+        for stream in entry["streams"]:
+            stream_filter = stream["filter"]
+            if stream_filter != "all" and "lat_lon_bboxes" in stream_filter:
+                bboxes = [
+                    [_normalize_lon(b[0]), b[1], _normalize_lon(b[2]), b[3]]
+                    for b in stream_filter["lat_lon_bboxes"]
+                ]
+                stream_filter = {**stream_filter, "lat_lon_bboxes": bboxes}
+            streams.append({**strip(stream), "filter": stream_filter})
+        entries.append({**strip(entry), "streams": streams})
+        # as query.build_url_table, the first entry of a url is kept
+        for url in entry["urls"]:
+            key = normalize_url(url)
+            parsed = urlparse(key)
+            urls.setdefault(key, [i, parsed.hostname, parsed.port])
+    return {
+        "release": data["release"],
+        "entries": entries,
+        "urls": urls,
+    }
+
+
+def write_compact(data, json_path):
+    """
+    Writes the compact artifacts of the catalog `data` next to json_path,
+    that query.load_json(compact=True) reads.
+    json_path must be already written, as they record its source_stamp.
+    """
+    compact = compact_catalog(data)
+    compact["source"] = source_stamp(json_path)
+    min_json_path, snapshot_path = compact_paths(json_path)
+    with open(min_json_path, "w") as f:
+        json.dump(compact, f, separators=(",", ":"))
+    with open(snapshot_path, "wb") as f:
+        marshal.dump((SNAPSHOT_VERSION, compact), f)
+
+
+def _shard_name(entry):
+    slug = re.sub(r"[^a-z0-9]+", "-", entry["name"].lower()).strip("-")
+    digest = hashlib.sha1(entry["name"].encode()).hexdigest()[:8]
+    return f"{slug}-{digest}.json"
+
+
+def write_shards(data, shards_dir, json_path=None):
+    """
+    Writes each entry of the catalog `data` to its own file in
+    shards_dir/entries, and shards_dir/manifest.json with the release,
+    the source_stamp of json_path if given, and the normalized url -> entry
+    file table, that query.ShardedCatalog reads. Stale entry files are removed.
+    """
+    entries_dir = os.path.join(shards_dir, "entries")
+    pathlib.Path(entries_dir).mkdir(parents=True, exist_ok=True)
+    urls = {}
+    names = set()
+    for entry in data["entries"]:
+        name = _shard_name(entry)
+        names.add(name)
+        with open(os.path.join(entries_dir, name), "w") as f:
+            json.dump(entry, f, indent=4)
+            f.write("\n")
+        for url in entry["urls"]:
+            urls.setdefault(normalize_url(url), "entries/" + name)
+    for name in os.listdir(entries_dir):
+        if name not in names:
+            os.remove(os.path.join(entries_dir, name))
+    manifest = {"release": data["release"]}
+    if json_path:
+        manifest["source"] = source_stamp(json_path)
+    manifest["urls"] = urls
+    with open(os.path.join(shards_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Generate a single json from collecting all the json in a tree."
@@ -85,6 +322,44 @@ def parse_args() -> argparse.Namespace:
         action=argparse.BooleanOptionalAction,
         default=True,
     )
+    parser.add_argument(
+        "--incremental",
+        help="Parse only the files changed since the previous incremental run",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help=(
+            "Manifest with the hashes and entries of the parsed files,"
+            " used by --incremental. Defaults to ../.cache/make_dist.manifest.json"
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of processes to parse the changed files. Defaults to the CPUs",
+    )
+    parser.add_argument(
+        "--compact",
+        help=(
+            "Write also the compact artifacts that query.load_json(compact=True)"
+            " reads: ntrip-catalog.min.json and ntrip-catalog.snapshot"
+        ),
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--shards",
+        type=str,
+        nargs="?",
+        const="",
+        help=(
+            "Write also one json per entry, and a manifest of their URLs,"
+            " in this folder. Defaults to the shards folder next to the output"
+        ),
+    )
     parser.add_argument(
         "--dry-run",
         help="Do not write output, but dump to stdout",
@@ -97,7 +372,12 @@ def parse_args() -> argparse.Namespace:
 
 def main():
     args = parse_args()
-    final = read_json(args.input, args.log_input_files)
+    manifest_path = None
+    if args.incremental:
+        manifest_path = args.manifest or os.path.join(
+            local_path, ".cache", "make_dist.manifest.json"
+        )
+    final = read_json(args.input, args.log_input_files, manifest_path, args.jobs)
     if args.dry_run:
         logger.info(json.dumps(final, indent=4))
     else:
@@ -110,6 +390,11 @@ def main():
         with open(outpath, "w") as f:
             json.dump(final, f, indent=4)
             f.write("\n")  # Add newline cause Py JSON does not
+        if args.compact:
+            write_compact(final, outpath)
+        if args.shards is not None:
+            shards_dir = args.shards or os.path.join(directory, "shards")
+            write_shards(final, shards_dir, outpath)
 
 
 if __name__ == "__main__":
@@ -3,51 +3,566 @@ this script tests a url, mountpoint and location against ntrip.catalog.json
 """
 
 import argparse
+import hashlib
 import json
 import logging
+import marshal
+import math
 import os
 import pathlib
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
 from io import BytesIO
 from urllib.parse import urlparse
 
-import pycurl
+# numpy and pycurl are imported by the functions that use them, as importing
+# them takes most of the start time of the script.
 
 local_path = pathlib.Path(__file__).parent.parent.resolve().as_posix()
 
 logger = logging.getLogger(__name__)
 
 
-def get_streams_from_server(url):
-    logger.debug(f"+++ Connecting to {url}")
-    sio = BytesIO()
-    curl = pycurl.Curl()
+def setup_curl(curl, url, write):
+    """Sets the options of a sourcetable request to url on a pycurl.Curl."""
+    import pycurl
+
     curl.setopt(pycurl.URL, url)
     curl.setopt(pycurl.TIMEOUT, 10)
     curl.setopt(pycurl.CONNECTTIMEOUT, 3)
     curl.setopt(pycurl.HTTP09_ALLOWED, True)
     curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_1_1)
-    curl.setopt(pycurl.WRITEFUNCTION, sio.write)
+    # curl decodes it. Casters without compression ignore the header.
+    curl.setopt(pycurl.ACCEPT_ENCODING, "gzip")
+    curl.setopt(pycurl.WRITEFUNCTION, write)
     curl.setopt(
         pycurl.HTTPHEADER, ["Ntrip-Version: Ntrip/2.0", "User-Agent: NTRIP Client/1.0"]
     )
 
+
+def decode_sourcetable(data):
+    try:
+        return data.decode().splitlines()
+    except UnicodeDecodeError:
+        return data.decode("iso-8859-1").splitlines()
+
+
+class CurlPool:
+    """
+    Reusable pycurl handles, one per thread, sharing the DNS cache, the open
+    connections and the TLS sessions through a pycurl.CurlShare.
+    """
+
+    def __init__(self):
+        import pycurl
+
+        self._share = pycurl.CurlShare()
+        self._share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self._share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+        self._share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        self._local = threading.local()
+
+    def curl(self):
+        """Returns the handle of the calling thread, with its options reset."""
+        import pycurl
+
+        curl = getattr(self._local, "curl", None)
+        if curl is None:
+            curl = self._local.curl = pycurl.Curl()
+            curl.setopt(pycurl.SHARE, self._share)
+        else:
+            curl.reset()  # keeps the share and the connections
+        return curl
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """CurlPool used by the fetch functions when none is given."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = CurlPool()
+    return _default_pool
+
+
+def get_streams_from_server(url, pool=None):
+    import pycurl
+
+    logger.debug(f"+++ Connecting to {url}")
+    sio = BytesIO()
+    curl = (pool or default_pool()).curl()
+    setup_curl(curl, url, sio.write)
+
     try:
         curl.perform()
-        curl.close()
-        try:
-            return sio.getvalue().decode().splitlines()
-        except Exception:
-            return sio.getvalue().decode("iso-8859-1").splitlines()
+        return decode_sourcetable(sio.getvalue())
 
     except pycurl.error as e:
         logger.error("pycurl exception " + str(e))
-        raise pycurl.error(e)
+        raise
     except Exception as e:
         logger.error("exception " + str(e))
         raise Exception(e)
 
 
+def _decode_line(line):
+    try:
+        return line.decode()
+    except UnicodeDecodeError:
+        return line.decode("iso-8859-1")
+
+
+class _StrLineScanner:
+    """
+    curl write callback that splits the response in lines as it arrives,
+    and aborts the transfer at the STR line of a mountpoint or ENDSOURCETABLE.
+    """
+
+    def __init__(self, mountpoint):
+        self.prefixes = tuple(
+            {f"STR;{mountpoint};".encode(e, "replace") for e in ("utf-8", "latin-1")}
+        )
+        self.pending = b""
+        self.line = None
+        self.finished = False
+
+    def _scan(self, line):
+        line = line.rstrip(b"\r")
+        if line.startswith(self.prefixes):
+            self.line = _decode_line(line).split(";")
+            self.finished = True
+        elif line.startswith(b"ENDSOURCETABLE"):
+            self.finished = True
+
+    def write(self, data):
+        buffer = self.pending + data
+        start = 0
+        end = buffer.find(b"\n")
+        while end >= 0:
+            self._scan(buffer[start:end])
+            if self.finished:
+                return 0  # any value but len(data) makes curl abort
+            start = end + 1
+            end = buffer.find(b"\n", start)
+        self.pending = buffer[start:]
+
+    def close(self):
+        if not self.finished and self.pending:
+            self._scan(self.pending)
+        self.pending = b""
+
+
+def get_str_line_streaming(url, mountpoint, pool=None):
+    """
+    Returns the splitted STR line of mountpoint from the sourcetable of url,
+    or None. Lines are parsed as they arrive, and the transfer is aborted
+    once the line, or ENDSOURCETABLE, is received.
+    """
+    import pycurl
+
+    logger.debug(f"+++ Connecting to {url} for {mountpoint}")
+    scanner = _StrLineScanner(mountpoint)
+    curl = (pool or default_pool()).curl()
+    setup_curl(curl, url, scanner.write)
+
+    try:
+        curl.perform()
+    except pycurl.error as e:
+        if not (scanner.finished and e.args[0] == pycurl.E_WRITE_ERROR):
+            logger.error("pycurl exception " + str(e))
+            raise
+    scanner.close()
+    return scanner.line
+
+
+class StrLineFetcher:
+    """
+    Sourcetable source for the `cache` of filter_crs that fetches only the
+    STR line of one mountpoint, see get_str_line_streaming.
+    """
+
+    def __init__(self, mountpoint, pool=None):
+        self.mountpoint = mountpoint
+        self.pool = pool
+
+    def get(self, url):
+        line = get_str_line_streaming(url, self.mountpoint, self.pool)
+        # if the line is missing, ENDSOURCETABLE keeps the sourcetable from being
+        # empty, so that filter_crs does not fetch it again for the next stream
+        return [";".join(line) if line else "ENDSOURCETABLE"]
+
+
+class StrRecord:
+    """
+    STR line of a sourcetable.
+    The line is split, and the position decoded, only when they are accessed.
+    """
+
+    __slots__ = ("line", "mountpoint", "_fields", "_lat", "_lon")
+
+    def __init__(self, line, mountpoint):
+        self.line = line
+        self.mountpoint = mountpoint
+        self._fields = None
+        self._lat = None
+        self._lon = None
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            self._fields = self.line.split(";")
+        return self._fields
+
+    def __len__(self):
+        return len(self.fields)
+
+    @property
+    def country(self):
+        return self.fields[8]
+
+    @property
+    def lat(self):
+        if self._lat is None:
+            self._lat = float(self.fields[9])
+        return self._lat
+
+    @property
+    def lon(self):
+        if self._lon is None:
+            self._lon = normalize_lon(float(self.fields[10]))
+        return self._lon
+
+
+class Sourcetable:
+    """
+    Sourcetable lines, parsed once into a mountpoint -> StrRecord index.
+    Iterating it yields the lines, so it can be used as the list of lines.
+    """
+
+    def __init__(self, lines=()):
+        self.lines = []
+        self.records = {}
+        self.nbytes = 0
+        self._digest = None
+        self.add_lines(lines)
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(text.splitlines())
+
+    def add_lines(self, lines):
+        self._digest = None
+        for line in lines:
+            self.lines.append(line)
+            self.nbytes += len(line) + 1
+            if line.startswith("STR;"):
+                splitted = line.split(";", 2)
+                if len(splitted) > 2 and splitted[1] not in self.records:
+                    self.records[splitted[1]] = StrRecord(line, splitted[1])
+        return self
+
+    __iadd__ = add_lines
+
+    def get(self, mountpoint):
+        return self.records.get(mountpoint)
+
+    @property
+    def mountpoints(self):
+        return list(self.records)
+
+    @property
+    def digest(self):
+        """sha1 of the lines, to tell apart two versions of a sourcetable."""
+        if self._digest is None:
+            sha = hashlib.sha1()
+            for line in self.lines:
+                sha.update(line.encode())
+                sha.update(b"\n")
+            self._digest = sha.hexdigest()
+        return self._digest
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+
+def as_sourcetable(lines):
+    """Returns lines as a Sourcetable, or None if there are no lines."""
+    if isinstance(lines, Sourcetable) or not lines:
+        return lines or None
+    return Sourcetable(lines)
+
+
+def fetch_sourcetable(url, cache=None):
+    if cache:
+        return as_sourcetable(cache.get(url)) or Sourcetable()
+    return Sourcetable(get_streams_from_server(url))
+
+
+def _sourcetable_nbytes(sourcetable):
+    if isinstance(sourcetable, Sourcetable):
+        return sourcetable.nbytes
+    return sum(len(line) + 1 for line in sourcetable)
+
+
+class SourcetableCache:
+    """
+    Bounded in-process cache of sourcetables, keyed by caster URL.
+
+    Entries expire `ttl` seconds after being fetched, and the least recently
+    used ones are evicted when the cached sourcetables exceed `max_bytes`.
+    Concurrent misses for the same URL share a single fetch.
+    `fetch` defaults to get_streams_from_server, parsed as a Sourcetable.
+    """
+
+    def __init__(self, ttl=300, max_bytes=32 * 1024 * 1024, fetch=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # url -> (expiration, nbytes, sourcetable)
+        self._inflight = {}  # url -> Future
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, url):
+        with self._lock:
+            cached = self._entries.get(url)
+            if cached and cached[0] > time.monotonic():
+                self._entries.move_to_end(url)
+                self.hits += 1
+                return cached[2]
+            future = self._inflight.get(url)
+            if future:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                leader = self._inflight[url] = Future()
+        if future:
+            return future.result()
+        return self._fetch_and_store(url, leader)
+
+    def _fetch_and_store(self, url, future):
+        try:
+            if self._fetch:
+                sourcetable = self._fetch(url)
+            else:
+                sourcetable = Sourcetable(get_streams_from_server(url))
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[url]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[url]
+            self._store(url, sourcetable)
+        future.set_result(sourcetable)
+        return sourcetable
+
+    def _store(self, url, sourcetable):
+        self._discard(url)
+        nbytes = _sourcetable_nbytes(sourcetable)
+        if nbytes > self.max_bytes:
+            return
+        expiration = time.monotonic() + self.ttl
+        self._entries[url] = (expiration, nbytes, sourcetable)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self.evictions += 1
+
+    def _discard(self, url):
+        cached = self._entries.pop(url, None)
+        if cached:
+            self.nbytes -= cached[1]
+
+    def invalidate(self, url):
+        with self._lock:
+            self._discard(url)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
+
+
+class NotCachedError(LookupError):
+    """The sourcetable of a url is not cached, and cannot be fetched offline."""
+
+
+class DiskSourcetableCache:
+    """
+    Sourcetables cached in a directory, shared by processes and runs.
+
+    Each URL is a json file with the lines, the fetch time and the digest of
+    the sourcetable, replaced atomically when it is fetched again.
+    Sourcetables younger than `max_age` seconds are fresh. Up to `stale`
+    seconds later they are still returned, and refreshed in the background
+    by one process at a time, holding a lock file. Older ones are fetched
+    again. `offline` returns the cached sourcetables of any age, and never
+    fetches. `fetch` defaults to get_streams_from_server.
+    It can be the `fetch` of a SourcetableCache, to cache in memory too.
+
+    The refresh runs in a daemon thread, that does not keep the process from
+    exiting. With `detached`, it runs instead in a process of its own, query.py
+    --refresh-sourcetable, that outlives a command line query. It fetches with
+    get_streams_from_server.
+    """
+
+    LOCK_TIMEOUT = 60
+
+    def __init__(
+        self,
+        directory=None,
+        max_age=300,
+        stale=0,
+        offline=False,
+        fetch=None,
+        detached=False,
+    ):
+        if not directory:
+            directory = os.path.join(local_path, ".cache", "sourcetables")
+        self.directory = directory
+        self.max_age = max_age
+        self.stale = stale
+        self.offline = offline
+        self.detached = detached
+        self._fetch = fetch
+
+    def path(self, url):
+        name = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def _read(self, url):
+        try:
+            with open(self.path(url)) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        try:
+            sourcetable = Sourcetable(cached["lines"])
+            fetched = float(cached["fetched"])
+            valid = cached["url"] == url and cached["digest"] == sourcetable.digest
+        except (AttributeError, KeyError, TypeError, ValueError):
+            valid = False
+        if not valid:
+            logger.warning(f"Ignoring a corrupted cached sourcetable of {url}")
+            return None, None
+        return fetched, sourcetable
+
+    def get(self, url):
+        fetched, sourcetable = self._read(url)
+        if fetched is not None:
+            age = time.time() - fetched
+            if age <= self.max_age or self.offline:
+                return sourcetable
+            if age <= self.max_age + self.stale:
+                if self._lock(url):
+                    self._start_refresh(url)
+                return sourcetable
+        elif self.offline:
+            raise NotCachedError(f"No cached sourcetable of {url}")
+        return self.fetch(url)
+
+    def fetch(self, url):
+        """Fetches the sourcetable of url, and stores it in the cache."""
+        import tempfile
+
+        if self._fetch:
+            sourcetable = as_sourcetable(self._fetch(url)) or Sourcetable()
+        else:
+            sourcetable = Sourcetable(get_streams_from_server(url))
+        os.makedirs(self.directory, exist_ok=True)
+        f = tempfile.NamedTemporaryFile("w", dir=self.directory, delete=False)
+        try:
+            with f:
+                json.dump(
+                    {
+                        "url": url,
+                        "fetched": time.time(),
+                        "digest": sourcetable.digest,
+                        "lines": sourcetable.lines,
+                    },
+                    f,
+                )
+            os.replace(f.name, self.path(url))
+        except BaseException:
+            os.unlink(f.name)
+            raise
+        return sourcetable
+
+    def _lock(self, url):
+        """Takes the refresh lock of url. False if another process holds it."""
+        lock_path = self.path(url) + ".lock"
+        try:
+            if time.time() - os.stat(lock_path).st_mtime > self.LOCK_TIMEOUT:
+                os.unlink(lock_path)  # left by a process that died refreshing
+        except OSError:
+            pass
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def _start_refresh(self, url):
+        if not self.detached:
+            threading.Thread(target=self._refresh, args=(url,), daemon=True).start()
+            return
+        import subprocess
+        import sys
+
+        command = [sys.executable, os.path.abspath(__file__)]
+        command += ["--refresh-sourcetable", url, "--cache-dir", self.directory]
+        try:
+            subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError as e:
+            logger.warning(f"Cannot refresh the sourcetable of {url}: {e}")
+            os.unlink(self.path(url) + ".lock")
+
+    def _refresh(self, url):
+        """Fetches url and releases the lock taken by get."""
+        try:
+            self.fetch(url)
+        except Exception as e:
+            logger.warning(f"Cannot refresh the sourcetable of {url}: {e}")
+        finally:
+            os.unlink(self.path(url) + ".lock")
+
+
 def get_str_line_from_server(streams_from_server, mountpoint):
+    if isinstance(streams_from_server, Sourcetable):
+        record = streams_from_server.get(mountpoint)
+        return record.fields if record else None
     for line in streams_from_server:
         splitted = line.split(";")
         if len(splitted) > 2 and splitted[0] == "STR" and splitted[1] == mountpoint:
@@ -55,14 +570,100 @@ def get_str_line_from_server(streams_from_server, mountpoint):
     return None
 
 
-def load_json(json_path=None):
+def load_json(json_path=None, compact=False):
+    """
+    Loads ntrip-catalog.json.
+    If `compact`, its compact artifacts are preferred when they were written
+    from this version of the file. They lack the descriptions and references of the
+    entries and streams, so they are only meant to resolve CRSs.
+    See make_dist.compact_catalog.
+    """
     path = json_path
     if not path:
         path = os.path.join(local_path, "dist", "ntrip-catalog.json")
+    if compact:
+        data = load_compact(path)
+        if data:
+            return data
     with open(path) as f:
         return json.load(f)
 
 
+# Version of the snapshots written by make_dist.write_compact
+SNAPSHOT_VERSION = 1
+
+
+def compact_paths(json_path):
+    """Returns the paths of the minified json and binary snapshot of json_path."""
+    base = os.path.splitext(json_path)[0]
+    return base + ".min.json", base + ".snapshot"
+
+
+def build_url_table(entries):
+    """Returns a dict normalized url -> [entry index, hostname, port]."""
+    table = {}
+    for i, entry in enumerate(entries):
+        for url in entry["urls"]:
+            key = normalize_url(url)
+            parsed = urlparse(key)
+            table.setdefault(key, [i, parsed.hostname, parsed.port])
+    return table
+
+
+def source_stamp(json_path):
+    """
+    Returns [size, mtime in ns] of json_path, recorded in the artifacts
+    derived from it. The release alone is not enough: the dist is updated
+    without a new release, and artifacts are not versioned.
+    """
+    stat = os.stat(json_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _read_release(json_path):
+    # make_dist writes the release at the top, so there is no need to parse it all
+    with open(json_path, "rb") as f:
+        match = re.search(rb'"release":\s*(\d+)', f.read(4096))
+    return int(match.group(1)) if match else None
+
+
+def _read_source_stamp(manifest_path):
+    # make_dist.write_shards writes it before the urls
+    with open(manifest_path, "rb") as f:
+        match = re.search(rb'"source":\[(\d+),(\d+)\]', f.read(4096))
+    return [int(match.group(1)), int(match.group(2))] if match else None
+
+
+def load_compact(json_path):
+    """
+    Returns the compact catalog of json_path, from the snapshot or else
+    the minified json, if they were written from the current json_path
+    (see source_stamp). Otherwise None.
+    """
+    min_json_path, snapshot_path = compact_paths(json_path)
+    stamp = None
+    for compact_path in (snapshot_path, min_json_path):
+        if not os.path.exists(compact_path):
+            continue
+        if stamp is None:
+            stamp = source_stamp(json_path)
+        try:
+            if compact_path == snapshot_path:
+                with open(compact_path, "rb") as f:
+                    version, data = marshal.loads(f.read())
+                if version != SNAPSHOT_VERSION:
+                    continue
+            else:
+                with open(compact_path) as f:
+                    data = json.load(f)
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            logger.debug(f"cannot load {compact_path}: {e}")
+            continue
+        if data.get("source") == stamp:
+            return data
+    return None
+
+
 def normalize_lon(lon):
     while lon > 180:
         lon -= 360
@@ -88,7 +689,7 @@ def point_in_bbox(point_lat, point_lon, bbox):
         return point_lon >= bbox[0] and point_lon <= bbox[2]
 
 
-def _crss_from_stream(stream, mountpoint, url, server_streams):
+def _crss_from_stream(stream, mountpoint, url, server_streams, cache=None):
     crss = stream["crss"]
     stream_filter = stream["filter"]
     if stream_filter == "all":
@@ -98,20 +699,45 @@ def _crss_from_stream(stream, mountpoint, url, server_streams):
             return crss
     else:
         if not server_streams:
-            server_streams += get_streams_from_server(url)
-        line = get_str_line_from_server(server_streams, mountpoint)
-        if not line or len(line) < 10:
-            return None
-        country = line[8]
-        base_lat = float(line[9])
-        base_lon = normalize_lon(float(line[10]))
-
-        if country in stream_filter.get("countries", []):
+            server_streams += fetch_sourcetable(url, cache)
+        if isinstance(server_streams, Sourcetable):
+            record = server_streams.get(mountpoint)
+        else:
+            line = get_str_line_from_server(server_streams, mountpoint)
+            record = StrRecord(";".join(line), mountpoint) if line else None
+        if _base_station_in_filter(stream_filter, record):
             return crss
 
-        for bbox in stream_filter.get("lat_lon_bboxes", []):
-            if point_in_bbox(base_lat, base_lon, bbox):
-                return crss
+
+def _base_station_in_filter(stream_filter, record):
+    if not record or len(record) < 10:
+        return False
+
+    if record.country in stream_filter.get("countries", []):
+        return True
+
+    for bbox in stream_filter.get("lat_lon_bboxes", []):
+        if point_in_bbox(record.lat, record.lon, bbox):
+            return True
+    return False
+
+
+def _needs_sourcetable(stream_filter):
+    return stream_filter != "all" and "mountpoints" not in stream_filter
+
+
+def filter_by_rover(crss, rover_lat, rover_lon, rover_country=None):
+    """Returns the first CRS whose rover_bbox or rover_countries match, or None."""
+    for crs in crss:
+        if "rover_bbox" in crs:
+            if point_in_bbox(rover_lat, rover_lon, crs["rover_bbox"]):
+                return crs
+        elif "rover_countries" in crs:
+            if rover_country and rover_country in crs["rover_countries"]:
+                return crs
+        else:
+            return crs
+    return None
 
 
 def filter_crs(
@@ -122,49 +748,751 @@ def filter_crs(
     rover_lon,
     rover_country=None,
     sourcetable_lines_splitted=None,
+    cache=None,
 ):
-    def filter_by_rover(crss):
-        for crs in crss:
-            if "rover_bbox" in crs:
-                if point_in_bbox(rover_lat, rover_lon, crs["rover_bbox"]):
-                    return crs
-            elif "rover_countries" in crs:
-                if rover_country and rover_country in crs["rover_countries"]:
-                    return crs
-            else:
-                return crs
-        return None
-
-    server_streams = [*sourcetable_lines_splitted] if sourcetable_lines_splitted else []
+    server_streams = as_sourcetable(sourcetable_lines_splitted)
 
     for stream in json_entry["streams"]:
-        crss = _crss_from_stream(stream, mountpoint, url, server_streams)
+        if not server_streams and _needs_sourcetable(stream["filter"]):
+            server_streams = fetch_sourcetable(url, cache)
+        crss = _crss_from_stream(stream, mountpoint, url, server_streams, cache)
         if crss:
-            crs = filter_by_rover(crss)
+            crs = filter_by_rover(crss, rover_lat, rover_lon, rover_country)
             if crs:
                 return crs
 
     return None
 
 
+def crs_candidates(
+    json_entry, url, mountpoint, sourcetable_lines_splitted=None, cache=None
+):
+    """
+    Returns the CRSs that filter_crs can choose for mountpoint, in order, up to
+    the first one without rover conditions. For any rover, filter_by_rover of
+    them is the CRS of filter_crs.
+    """
+    server_streams = as_sourcetable(sourcetable_lines_splitted)
+    candidates = []
+    for stream in json_entry["streams"]:
+        if not server_streams and _needs_sourcetable(stream["filter"]):
+            server_streams = fetch_sourcetable(url, cache)
+        crss = _crss_from_stream(stream, mountpoint, url, server_streams, cache)
+        for crs in crss or []:
+            candidates.append(crs)
+            if "rover_bbox" not in crs and "rover_countries" not in crs:
+                return candidates
+    return candidates
+
+
+def _split_bbox(bbox):
+    """Normalized bbox as (west, south, east, north) tuples, split at antimeridian."""
+    west, south, east, north = normalize_bbox(bbox)
+    if west > east:
+        return ((west, south, 180, north), (-180, south, east, north))
+    return ((west, south, east, north),)
+
+
+def _in_boxes(lat, lon, boxes):
+    """point_in_bbox for boxes of _split_bbox. `lon` must be already normalized."""
+    for west, south, east, north in boxes:
+        if south <= lat <= north and west <= lon <= east:
+            return True
+    return False
+
+
+_ANY, _ROVER_BBOX, _ROVER_COUNTRIES = range(3)
+
+
+class EntryResolver:
+    """
+    The streams of an entry compiled for filter_crs, see compile_entry.
+
+    Mountpoint filters are a dict from mountpoint to the indexes of the
+    streams to try, in order. Countries are frozensets and bboxes are
+    normalized and split at the antimeridian.
+    """
+
+    __slots__ = ("_streams", "_by_mountpoint", "_default")
+
+    def __init__(self, json_entry):
+        streams = []
+        by_mountpoint = {}
+        default = []
+        for i, stream in enumerate(json_entry["streams"]):
+            stream_filter = stream["filter"]
+            crss = tuple(
+                (
+                    (_ROVER_BBOX, _split_bbox(crs["rover_bbox"]), crs)
+                    if "rover_bbox" in crs
+                    else (
+                        (_ROVER_COUNTRIES, frozenset(crs["rover_countries"]), crs)
+                        if "rover_countries" in crs
+                        else (_ANY, None, crs)
+                    )
+                )
+                for crs in stream["crss"]
+            )
+            if stream_filter == "all":
+                streams.append((None, crss))
+            elif "mountpoints" in stream_filter:
+                streams.append((None, crss))
+                for mountpoint in frozenset(stream_filter["mountpoints"]):
+                    by_mountpoint.setdefault(mountpoint, list(default)).append(i)
+                continue
+            else:
+                countries = frozenset(stream_filter.get("countries", ()))
+                boxes = tuple(
+                    box
+                    for bbox in stream_filter.get("lat_lon_bboxes", ())
+                    for box in _split_bbox(bbox)
+                )
+                streams.append(((countries, boxes), crss))
+            # streams not filtered by mountpoint are candidates for all of them
+            default.append(i)
+            for candidates in by_mountpoint.values():
+                candidates.append(i)
+        self._streams = tuple(streams)
+        self._by_mountpoint = {mp: tuple(c) for mp, c in by_mountpoint.items()}
+        self._default = tuple(default)
+
+    def resolve(
+        self,
+        url,
+        mountpoint,
+        rover_lat,
+        rover_lon,
+        rover_country=None,
+        sourcetable_lines_splitted=None,
+        cache=None,
+    ):
+        """Same arguments and result as filter_crs."""
+        server_streams = as_sourcetable(sourcetable_lines_splitted)
+        for i in self._by_mountpoint.get(mountpoint, self._default):
+            station_filter, crss = self._streams[i]
+            if station_filter:
+                if not server_streams:
+                    server_streams = fetch_sourcetable(url, cache)
+                record = server_streams.get(mountpoint)
+                if not record or len(record) < 10:
+                    continue
+                countries, boxes = station_filter
+                if record.country not in countries and not (
+                    boxes and _in_boxes(record.lat, record.lon, boxes)
+                ):
+                    continue
+            for kind, data, crs in crss:
+                if kind == _ROVER_BBOX:
+                    if not _in_boxes(rover_lat, normalize_lon(rover_lon), data):
+                        continue
+                elif kind == _ROVER_COUNTRIES:
+                    if not (rover_country and rover_country in data):
+                        continue
+                if crs:
+                    return crs
+                break
+        return None
+
+
+def compile_entry(json_entry):
+    """Returns the EntryResolver of a catalog entry, to call filter_crs faster."""
+    return EntryResolver(json_entry)
+
+
+def _normalize_lon_array(lons):
+    import numpy as np
+
+    # same arithmetic as normalize_lon, so that results are identical
+    lons = np.array(lons, dtype=float)
+    for sign in (1, -1):
+        outside = sign * lons > 180
+        while outside.any():
+            lons[outside] -= sign * 360
+            outside = sign * lons > 180
+    return lons
+
+
+def _points_in_bbox(lats, lons, bbox):
+    """Vectorized point_in_bbox. `lons` must be already normalized."""
+    bbox = normalize_bbox(bbox)
+    inside = ~((lats > bbox[3]) | (lats < bbox[1]))
+    if bbox[0] > bbox[2]:
+        # crossing antimeridian
+        return inside & ((lons >= bbox[0]) | (lons <= bbox[2]))
+    else:
+        return inside & (lons >= bbox[0]) & (lons <= bbox[2])
+
+
+def _filter_crs_rows(
+    json_entry, url, mountpoints, lats, lons, countries, sourcetable, cache
+):
+    import numpy as np
+
+    result = np.empty(len(mountpoints), dtype=object)
+    unique_mountpoints, mountpoint_index = np.unique(mountpoints, return_inverse=True)
+    unresolved = np.ones(len(mountpoints), dtype=bool)
+
+    for stream in json_entry["streams"]:
+        if not unresolved.any():
+            break
+        stream_filter = stream["filter"]
+        if stream_filter == "all":
+            matches = unresolved.copy()
+        else:
+            if "mountpoints" in stream_filter:
+                selected = set(stream_filter["mountpoints"])
+                in_filter = [mp in selected for mp in unique_mountpoints]
+            else:
+                if not sourcetable:
+                    sourcetable = fetch_sourcetable(url, cache)
+                in_filter = [
+                    _base_station_in_filter(stream_filter, sourcetable.get(mp))
+                    for mp in unique_mountpoints
+                ]
+            matches = unresolved & np.array(in_filter, dtype=bool)[mountpoint_index]
+
+        for crs in stream["crss"]:
+            if not matches.any():
+                break
+            if "rover_bbox" in crs:
+                found = matches & _points_in_bbox(lats, lons, crs["rover_bbox"])
+            elif "rover_countries" in crs:
+                in_countries = np.isin(countries, crs["rover_countries"])
+                found = matches & in_countries & (countries != "")
+            else:
+                found = matches
+            result[found] = [crs]
+            matches &= ~found
+            unresolved &= ~found
+    return result
+
+
+def filter_crs_batch(
+    catalog,
+    urls,
+    mountpoints,
+    rover_lats,
+    rover_lons,
+    rover_countries=None,
+    sourcetables=None,
+    cache=None,
+):
+    """
+    filter_crs for many rows at once, with the rover tests vectorized.
+
+    The rows are grouped by URL, looked up in `catalog`, and resolved with the
+    same first-match semantics as filter_crs. `sourcetables` is an optional
+    dict url -> lines or Sourcetable. Otherwise the sourcetables are fetched
+    once per URL, through `cache` if given.
+    Returns a list with the chosen CRS, or None, for each row.
+    """
+    import numpy as np
+
+    urls = np.asarray(urls, dtype=str)
+    mountpoints = np.asarray(mountpoints, dtype=str)
+    lats = np.asarray(rover_lats, dtype=float)
+    lons = _normalize_lon_array(rover_lons)
+    if rover_countries is None:
+        countries = np.full(len(urls), "")
+    else:
+        countries = np.array([c or "" for c in rover_countries], dtype=str)
+    if not (len(urls) == len(mountpoints) == len(lats) == len(lons) == len(countries)):
+        raise ValueError("All the input arrays must have the same length")
+    sourcetables = sourcetables or {}
+
+    result = np.empty(len(urls), dtype=object)
+    unique_urls, url_index = np.unique(urls, return_inverse=True)
+    order = np.argsort(url_index, kind="stable")
+    groups = np.split(order, np.cumsum(np.bincount(url_index))[:-1])
+    for url, rows in zip(unique_urls, groups):
+        json_entry = catalog.search_url(url)
+        if not json_entry:
+            continue
+        result[rows] = _filter_crs_rows(
+            json_entry,
+            str(url),
+            mountpoints[rows],
+            lats[rows],
+            lons[rows],
+            countries[rows],
+            as_sourcetable(sourcetables.get(url)),
+            cache,
+        )
+    return result.tolist()
+
+
+def _station_positions(records):
+    """
+    Returns the mask of records with station fields, and their countries, lats
+    and normalized lons. Positions that cannot be parsed are NaN.
+    """
+    import numpy as np
+
+    valid = []
+    countries = []
+    lats = []
+    lons = []
+    for record in records:
+        # only up to the longitude, as len(record) >= 10 of _base_station_in_filter
+        fields = record.line.split(";", 11)
+        if len(fields) < 10:
+            valid.append(False)
+            countries.append("")
+            lats.append(math.nan)
+            lons.append(math.nan)
+            continue
+        valid.append(True)
+        countries.append(fields[8])
+        try:
+            lat, lon = float(fields[9]), float(fields[10])
+        except (IndexError, ValueError):
+            lat = lon = math.nan
+        lats.append(lat)
+        lons.append(lon)
+    return (
+        np.array(valid, dtype=bool),
+        np.array(countries, dtype=str),
+        np.array(lats, dtype=float),
+        _normalize_lon_array(lons),
+    )
+
+
+def resolve_all_mountpoints(json_entry, url=None, sourcetable=None, cache=None):
+    """
+    Returns a dict with the CRS candidates of every STR mountpoint of the
+    sourcetable, in one pass. The candidates are the CRSs of the streams of
+    the entry that match the mountpoint, in order, up to the first one without
+    rover conditions. filter_by_rover of the candidates is the CRS filter_crs
+    returns. The sourcetable is fetched from url if not given.
+    """
+    import numpy as np
+
+    sourcetable = as_sourcetable(sourcetable)
+    if not sourcetable:
+        sourcetable = fetch_sourcetable(url, cache)
+    records = list(sourcetable.records.values())
+    mountpoints = np.array([record.mountpoint for record in records], dtype=str)
+    positions = None
+    candidates = [[] for _ in records]
+    open_mountpoints = np.ones(len(records), dtype=bool)
+
+    for stream in json_entry["streams"]:
+        stream_filter = stream["filter"]
+        if stream_filter == "all":
+            matches = open_mountpoints.copy()
+        elif "mountpoints" in stream_filter:
+            in_filter = np.isin(mountpoints, stream_filter["mountpoints"])
+            matches = open_mountpoints & in_filter
+        else:
+            if positions is None:
+                positions = _station_positions(records)
+            valid, countries, lats, lons = positions
+            in_filter = np.isin(countries, stream_filter.get("countries", []))
+            for bbox in stream_filter.get("lat_lon_bboxes", []):
+                in_filter |= _points_in_bbox(lats, lons, bbox)
+            matches = open_mountpoints & in_filter & valid
+        crss = []
+        for crs in stream["crss"]:
+            crss.append(crs)
+            if "rover_bbox" not in crs and "rover_countries" not in crs:
+                # matches any rover, the next ones are never reached
+                open_mountpoints &= ~matches
+                break
+        for i in np.flatnonzero(matches):
+            candidates[i] += crss
+
+    return {record.mountpoint: c for record, c in zip(records, candidates)}
+
+
 def search_url_in_data(url, data):
+    if isinstance(data, Catalog):
+        return data.search_url(url)
     for entry in data["entries"]:
         if url in entry["urls"]:
             return entry
     return None
 
 
-def get_url_from_args(args):
-    url = args.url
-    if not url.startswith("http"):
+def normalize_url(url, port=None):
+    """
+    Returns the catalog form "scheme://hostname:port" of url.
+    The scheme defaults to http, and the port to `port` or 2101.
+    """
+    if "://" not in url:
         url = "http://" + url
-    parsed = urlparse(args.url)
+    parsed = urlparse(url)
     hostname = parsed.hostname
     if not hostname:
-        raise Exception(f"{url} is not a valid URL")
-    port = parsed.port or args.port or 2101
-    res = parsed.scheme + "://" + parsed.hostname + ":" + str(port)
-    return res
+        raise ValueError(f"{url} is not a valid URL")
+    if ":" in hostname:
+        hostname = f"[{hostname}]"  # IPv6
+    port = parsed.port or port or 2101
+    return parsed.scheme.lower() + "://" + hostname + ":" + str(port)
+
+
+class BboxGrid:
+    """
+    Uniform grid of cells over lat/lon bboxes, to find the ones containing a point.
+    Bboxes crossing the antimeridian are split in two parts.
+    """
+
+    def __init__(self, cell_size=5):
+        self.cell_size = cell_size
+        self._cells = {}
+
+    def _index(self, value):
+        return math.floor(value / self.cell_size)
+
+    def insert(self, bbox, item):
+        west, south, east, north = normalize_bbox(bbox)
+        if west > east:
+            parts = [(west, 180), (-180, east)]
+        else:
+            parts = [(west, east)]
+        for west, east in parts:
+            for x in range(self._index(west), self._index(east) + 1):
+                for y in range(self._index(south), self._index(north) + 1):
+                    self._cells.setdefault((x, y), []).append((bbox, item))
+
+    def query(self, lat, lon):
+        """Returns the items whose bbox contains the point, in insertion order."""
+        lon = normalize_lon(lon)
+        candidates = self._cells.get((self._index(lon), self._index(lat)), [])
+        return [item for bbox, item in candidates if point_in_bbox(lat, lon, bbox)]
+
+
+Coverage = namedtuple("Coverage", ["entry", "stream", "crs", "bbox"])
+
+
+class Catalog:
+    """
+    ntrip-catalog loaded in memory, with hash indexes on the entry URLs.
+
+    Besides the exact URL, entries can be searched by hostname and port
+    (any scheme) or by hostname only (any scheme and port).
+    The rover_bbox and lat_lon_bboxes are indexed in a BboxGrid, for the
+    reverse lookup by rover position. The grid is built on the first lookup.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.release = data.get("release")
+        self.entries = data["entries"]
+        self._by_url = {}
+        self._by_host_port = {}
+        self._by_host = {}
+        # compact catalogs include the table. It keeps the first entry of a url,
+        # as the linear search does.
+        url_table = data.get("urls") or build_url_table(self.entries)
+        for key, (i, hostname, port) in url_table.items():
+            entry = self.entries[i]
+            self._by_url[key] = entry
+            for index, index_key in (
+                (self._by_host_port, (hostname, port)),
+                (self._by_host, hostname),
+            ):
+                found = index.setdefault(index_key, [])
+                if not found or found[-1] is not entry:
+                    found.append(entry)
+        self._grid = None
+        self._resolvers = {}  # id(entry) -> EntryResolver
+
+    @classmethod
+    def from_file(cls, json_path=None, compact=False):
+        return cls(load_json(json_path, compact))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search_url(self, url, port=None):
+        """Returns the entry for url, or None. See normalize_url for defaults."""
+        try:
+            return self._by_url.get(normalize_url(url, port))
+        except ValueError:
+            return None
+
+    def search_host_port(self, hostname, port):
+        """Returns the entries serving hostname:port with any scheme."""
+        return list(self._by_host_port.get((hostname.lower(), int(port)), []))
+
+    def search_host(self, hostname):
+        """Returns the entries serving hostname with any scheme and port."""
+        return list(self._by_host.get(hostname.lower(), []))
+
+    def resolver(self, url, port=None):
+        """
+        Returns the EntryResolver of the entry for url, or None.
+        Entries are compiled on first use.
+        """
+        entry = self.search_url(url, port)
+        if entry is None:
+            return None
+        resolver = self._resolvers.get(id(entry))
+        if resolver is None:
+            resolver = self._resolvers[id(entry)] = compile_entry(entry)
+        return resolver
+
+    @property
+    def grid(self):
+        """BboxGrid of the catalog, built on first use."""
+        if self._grid is None:
+            grid = BboxGrid()
+            for entry in self.entries:
+                for stream in entry["streams"]:
+                    stream_filter = stream["filter"]
+                    if stream_filter != "all":
+                        for bbox in stream_filter.get("lat_lon_bboxes", []):
+                            for crs in stream["crss"]:
+                                grid.insert(bbox, Coverage(entry, stream, crs, bbox))
+                    for crs in stream["crss"]:
+                        if "rover_bbox" in crs:
+                            bbox = crs["rover_bbox"]
+                            grid.insert(bbox, Coverage(entry, stream, crs, bbox))
+            self._grid = grid
+        return self._grid
+
+    def covering(self, lat, lon):
+        """
+        Returns the Coverage (entry, stream, crs, bbox) of every CRS with a
+        rover_bbox, or in a stream with lat_lon_bboxes, that contains the point.
+        Each CRS is returned once, in catalog order.
+        """
+        found = set()
+        res = []
+        for coverage in self.grid.query(lat, lon):
+            key = (id(coverage.entry), id(coverage.stream), id(coverage.crs))
+            if key not in found:
+                found.add(key)
+                res.append(coverage)
+        return res
+
+
+class ShardedCatalog:
+    """
+    Catalog read from the shards written by write_shards.
+    Only the manifest is loaded, and each entry file is read the first time
+    one of its URLs is searched.
+    """
+
+    def __init__(self, manifest_path=None):
+        if not manifest_path:
+            manifest_path = os.path.join(local_path, "dist", "shards", "manifest.json")
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        self.release = manifest["release"]
+        self._urls = manifest["urls"]
+        self._directory = os.path.dirname(manifest_path)
+        self._entries = {}  # entry file -> entry
+
+    def search_url(self, url, port=None):
+        """Returns the entry for url, or None. See normalize_url for defaults."""
+        try:
+            shard = self._urls.get(normalize_url(url, port))
+        except ValueError:
+            return None
+        if not shard:
+            return None
+        entry = self._entries.get(shard)
+        if entry is None:
+            with open(os.path.join(self._directory, shard)) as f:
+                entry = json.load(f)
+            self._entries[shard] = entry
+        return entry
+
+
+_catalogs = {}
+
+
+def get_catalog(json_path=None, compact=False):
+    """
+    Returns the Catalog for json_path. It is loaded only the first time.
+    See load_json for `compact`.
+    """
+    catalog = _catalogs.get((json_path, compact))
+    if catalog is None:
+        catalog = Catalog.from_file(json_path, compact)
+        _catalogs[(json_path, compact)] = catalog
+    return catalog
+
+
+def _is_newer(release, current):
+    return release is not None and (current is None or release > current)
+
+
+class CatalogHolder:
+    """
+    Catalog of a long running process, reloaded when make_dist writes a new
+    release of json_path.
+
+    The first access to `catalog` loads json_path, not the Catalog that
+    get_catalog may have loaded before from an older version. Once started, a
+    background thread polls the file every `interval` seconds; a new version
+    is loaded and indexed in that thread, and swapped in only if its release
+    is greater than the current one. The swaps do not update get_catalog, so
+    long running processes must only read the holder. Requests should read
+    `catalog` once and keep that snapshot, so that they finish on the release
+    they started with.
+    Other state, as the sourcetable caches, is not tied to the catalog and
+    survives the swap.
+    With `compact`, the compact artifacts are loaded when they are current,
+    for processes that only resolve CRSs (see load_json).
+    """
+
+    def __init__(self, json_path=None, interval=5, compact=False):
+        self.json_path = json_path
+        self.interval = interval
+        self.compact = compact
+        self.reloads = 0
+        self.rejected = 0
+        self._catalog = None
+        self._stat = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def path(self):
+        return self.json_path or os.path.join(local_path, "dist", "ntrip-catalog.json")
+
+    @property
+    def catalog(self):
+        catalog = self._catalog
+        if catalog is None:
+            with self._lock:
+                if self._catalog is None:
+                    # a later change of the file is then seen by check
+                    self._stat = self._file_stat()
+                    self._catalog = Catalog.from_file(self.json_path, self.compact)
+                catalog = self._catalog
+        return catalog
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def check(self):
+        """Reloads the catalog if the file changed. Returns True if swapped."""
+        current = self.catalog
+        stat = self._file_stat()
+        if stat is None or stat == self._stat:
+            return False
+        # a file being written is seen again when it is complete, with a new stat
+        self._stat = stat
+        path = self.path
+        start = time.perf_counter()
+        try:
+            # make_dist writes the release at the top, check it before parsing
+            release = _read_release(path)
+            if release is None or _is_newer(release, current.release):
+                catalog = Catalog.from_file(self.json_path, self.compact)
+                release = catalog.release
+        except (OSError, ValueError, KeyError) as e:
+            self.rejected += 1
+            logger.warning(f"Not reloading {path}: {e}")
+            return False
+        if not _is_newer(release, current.release):
+            self.rejected += 1
+            logger.warning(
+                f"Not reloading {path}: release {release} is not newer"
+                f" than {current.release}"
+            )
+            return False
+        if current._grid is not None:
+            catalog.grid  # build it here instead of in a request
+        self._catalog = catalog
+        self.reloads += 1
+        logger.info(
+            f"Reloaded {path}: release {current.release} -> {catalog.release},"
+            f" {len(catalog)} entries in {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+        return True
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception(f"Reloading {self.path} failed")
+
+    def start(self):
+        """Loads the catalog and starts watching the file."""
+        self.catalog
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def get_url_from_args(args):
+    return normalize_url(args.url, args.port)
+
+
+def shards_manifest_for(json_path=None):
+    """
+    Returns the path of the manifest of the shards written by make_dist next
+    to json_path, if they exist and were written from the current json_path
+    (see source_stamp). Otherwise None.
+    """
+    if not json_path:
+        json_path = os.path.join(local_path, "dist", "ntrip-catalog.json")
+    manifest_path = os.path.join(os.path.dirname(json_path), "shards", "manifest.json")
+    try:
+        stamp = _read_source_stamp(manifest_path)
+        if stamp is not None and stamp == source_stamp(json_path):
+            return manifest_path
+    except OSError:
+        pass
+    return None
+
+
+def _entry_from_args(args, url):
+    # a single entry only needs the shards manifest and the file of the entry
+    manifest_path = args.shards_manifest or shards_manifest_for(args.json_path)
+    if manifest_path:
+        return ShardedCatalog(manifest_path).search_url(url)
+    # only the CRSs are resolved, the compact catalog is enough
+    return get_catalog(args.json_path, compact=True).search_url(url)
+
+
+def _sourcetable_from_args(args):
+    """The lines of --sourcetable, a file or the sourcetable itself, or None."""
+    if not args.sourcetable:
+        return None
+    if os.path.exists(args.sourcetable):
+        with open(args.sourcetable) as f:
+            sourcetable = f.read()
+    else:
+        sourcetable = args.sourcetable
+
+    if "STR" not in sourcetable:
+        raise Exception("Cannot find STR in provided sourcetable")
+    return sourcetable.splitlines()
+
+
+def _disk_cache_from_args(args):
+    """The DiskSourcetableCache of --max-age or --offline, or None."""
+    if args.max_age is None and not args.offline:
+        return None
+    # the process exits right after the query, so the refresh must outlive it
+    return DiskSourcetableCache(
+        args.cache_dir, args.max_age or 0, args.stale, args.offline, detached=True
+    )
 
 
 def query_ntrip_catalog(args):
@@ -172,24 +1500,17 @@ def query_ntrip_catalog(args):
     if args.log_streams:
         logger.info(f"Connecting to {url}")
         logger.info("\n".join(get_streams_from_server(url)))
-    json_data = load_json(args.json_path)
-    entry = search_url_in_data(url, json_data)
+    entry = _entry_from_args(args, url)
     if not entry:
         # the url is not found among the entries
         return None
 
-    sourcetable_lines_splitted = None
-    if args.sourcetable:
-        if os.path.exists(os.path(args.sourcetable)):
-            with open(args.sourcetable) as f:
-                sourcetable_lines_splitted = f.read()
-        else:
-            sourcetable_lines_splitted = args.sourcetable
-
-        if "STR" not in sourcetable_lines_splitted:
-            raise Exception("Cannot find STR in provided sourcetable")
-        else:
-            sourcetable_lines_splitted = sourcetable_lines_splitted.splitlines()
+    # the sourcetable is fetched only if a stream filtered by the STR lines is
+    # reached before the CRS is decided
+    cache = _disk_cache_from_args(args)
+    if not cache and args.streaming:
+        # only the line of the mountpoint is needed
+        cache = StrLineFetcher(args.mountpoint)
 
     crs = filter_crs(
         entry,
@@ -198,11 +1519,96 @@ def query_ntrip_catalog(args):
         args.rover_lat,
         args.rover_lon,
         args.rover_country,
-        sourcetable_lines_splitted,
+        _sourcetable_from_args(args),
+        cache,
     )
     return crs
 
 
+def query_all_mountpoints(args):
+    """Returns the resolve_all_mountpoints of the url, or None if not found."""
+    url = get_url_from_args(args)
+    entry = _entry_from_args(args, url)
+    if not entry:
+        return None
+    return resolve_all_mountpoints(
+        entry, url, _sourcetable_from_args(args), _disk_cache_from_args(args)
+    )
+
+
+def _default_daemon_socket():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "ntrip-catalog-query.sock")
+    # /tmp is shared by all the users: one socket each, and its owner is checked
+    return os.path.join("/tmp", f"ntrip-catalog-query-{os.getuid()}.sock")
+
+
+# Socket of scripts/query_daemon.py
+DAEMON_SOCKET = _default_daemon_socket()
+
+
+def encode_daemon_query(url, port, mountpoint, rover_lat, rover_lon, rover_country):
+    """
+    Returns the request line of the query daemon: the arguments of
+    query_ntrip_catalog separated by tabs, empty if None.
+    """
+    fields = (url, port, mountpoint, rover_lat, rover_lon, rover_country)
+    return "\t".join("" if f is None else str(f) for f in fields) + "\n"
+
+
+def query_daemon(args, socket_path=None):
+    """
+    Resolves the query of args in the query daemon. Returns the CRS, or None.
+    Raises OSError if the daemon is not running, or if the socket belongs to
+    another user, and RuntimeError with the error of the daemon if the query
+    fails.
+    """
+    import socket
+
+    socket_path = socket_path or DAEMON_SOCKET
+    # another user could listen there, and answer wrong CRSs
+    if os.stat(socket_path).st_uid != os.getuid():
+        raise PermissionError(f"{socket_path} belongs to another user")
+
+    request = encode_daemon_query(
+        args.url,
+        args.port,
+        args.mountpoint,
+        args.rover_lat,
+        args.rover_lon,
+        args.rover_country,
+    )
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(30)
+        sock.connect(socket_path)
+        sock.sendall(request.encode())
+        with sock.makefile("rb") as f:
+            response = f.readline().decode().rstrip("\n")
+    status, _, payload = response.partition("\t")
+    if status != "OK":
+        raise RuntimeError(payload or "the query daemon closed the connection")
+    return json.loads(payload)
+
+
+def _daemon_can_answer(args):
+    # the daemon has its own catalog, and fetches and caches the sourcetables its
+    # own way, so the options about them are only honoured here
+    local_options = (
+        args.json_path,
+        args.shards_manifest,
+        args.sourcetable,
+        args.log_streams,
+        args.all_mountpoints,
+        args.max_age is not None,
+        args.stale,
+        args.offline,
+        args.cache_dir,
+        not args.streaming,
+    )
+    return args.daemon and not any(local_options)
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Test a url, mountpoint and location against ntrip.catalog.json."
@@ -213,6 +1619,15 @@ def parse_args() -> argparse.Namespace:
         type=str,
         help="Location of ntrip-catalog.json. Defaults to ../dist/ntrip-catalog.json",
     )
+    parser.add_argument(
+        "--shards-manifest",
+        type=str,
+        help=(
+            "Location of the manifest.json of a sharded dist (see make_dist.py"
+            " --shards). Only the entry of the URL is loaded. Defaults to the"
+            " shards next to --json-path, if they have the same release."
+        ),
+    )
     parser.add_argument(
         "--url",
         type=str,
@@ -242,7 +1657,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--rover-country",
         help="Rover country (3 letter code)",
-        type=float,
+        type=str,
     )
     parser.add_argument(
         "--sourcetable",
@@ -252,6 +1667,77 @@ def parse_args() -> argparse.Namespace:
         ),
         type=str,
     )
+    parser.add_argument(
+        "--covering",
+        help=(
+            "List the entries and CRSs whose rover_bbox or lat_lon_bboxes"
+            " contain the rover latitude and longitude, instead of querying a URL."
+        ),
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--all-mountpoints",
+        help=(
+            "List the CRS candidates of every mountpoint in the sourcetable of"
+            " the URL, instead of querying one mountpoint."
+        ),
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--streaming",
+        help=(
+            "Stop receiving the sourcetable once the STR of the mountpoint arrives."
+            " Otherwise the whole sourcetable is fetched."
+        ),
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        help=(
+            "Use the sourcetables cached on disk if they are younger than these"
+            " seconds. Otherwise the sourcetable is fetched and cached."
+        ),
+    )
+    parser.add_argument(
+        "--stale",
+        type=float,
+        help=(
+            "Seconds after --max-age that a cached sourcetable is still used,"
+            " while it is fetched again in the background."
+        ),
+        default=0,
+    )
+    parser.add_argument(
+        "--offline",
+        help="Use the sourcetables cached on disk of any age, and never fetch them.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="Directory of the sourcetables cache. Defaults to ../.cache/sourcetables",
+    )
+    # run by DiskSourcetableCache to refresh a stale sourcetable in the background
+    parser.add_argument("--refresh-sourcetable", type=str, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--daemon",
+        help=(
+            "Ask the query daemon (see query_daemon.py), with its catalog and"
+            " sourcetables in memory. If it is not running, or with options about"
+            " the catalog file or the sourcetable fetch, the query runs here."
+        ),
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--daemon-socket",
+        type=str,
+        help=f"Socket of the query daemon. Defaults to {DAEMON_SOCKET}",
+    )
     parser.add_argument(
         "--log-streams",
         help="Logs all the STR.",
@@ -265,7 +1751,32 @@ def parse_args() -> argparse.Namespace:
 def main():
     logging.basicConfig(level=logging.INFO)
     args = parse_args()
-    crs = query_ntrip_catalog(args)
+    if args.refresh_sourcetable:
+        DiskSourcetableCache(args.cache_dir)._refresh(args.refresh_sourcetable)
+        return
+    if args.covering:
+        catalog = get_catalog(args.json_path, compact=True)
+        for coverage in catalog.covering(args.rover_lat, args.rover_lon):
+            urls = ", ".join(coverage.entry["urls"])
+            logger.info(f"{coverage.entry['name']} ({urls}): {coverage.crs}")
+        return
+    if _daemon_can_answer(args):
+        try:
+            logger.info(query_daemon(args, args.daemon_socket))
+            return
+        except OSError as e:
+            logger.debug(f"query daemon not available, running here: {e}")
+    try:
+        if args.all_mountpoints:
+            table = query_all_mountpoints(args)
+            for mountpoint, crss in (table or {}).items():
+                logger.info(f"{mountpoint}: {crss}")
+            return
+        crs = query_ntrip_catalog(args)
+    except NotCachedError as e:
+        # --offline, and the CRS depends on a sourcetable that was never fetched
+        logger.error(e)
+        raise SystemExit(1)
     logger.info(crs)
 
 
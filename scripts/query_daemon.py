@@ -0,0 +1,189 @@
+"""
+this script keeps the catalog, its compiled resolvers and the sourcetables in
+memory, and resolves the queries of query.py --daemon over a Unix socket
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from scripts import query as ntrip_query  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def _optional_float(value):
+    return float(value) if value else None
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """
+    Line protocol. Each request is a line with the tab separated url, port,
+    mountpoint, rover lat, rover lon and rover country (see
+    query.encode_daemon_query), empty if not given. The response is a line
+    with OK and the json of the CRS, or ERR and the error, separated by a tab.
+    A STATS line returns the counters of the sourcetable cache, and the release
+    and reloads of the catalog.
+    Connections can send any number of requests.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            response = self.server.respond(line.decode().rstrip("\r\n"))
+            self.wfile.write(response.encode() + b"\n")
+
+
+class QueryDaemon(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path=None,
+        json_path=None,
+        cache_ttl=300,
+        fetch=None,
+        reload_interval=5,
+    ):
+        self.socket_path = socket_path or ntrip_query.DAEMON_SOCKET
+        self.catalog_holder = ntrip_query.CatalogHolder(
+            json_path, reload_interval, compact=True
+        )
+        self.sourcetable_cache = ntrip_query.SourcetableCache(
+            ttl=cache_ttl, fetch=fetch
+        )
+        _remove_stale_socket(self.socket_path)
+        super().__init__(self.socket_path, QueryHandler)
+        self.catalog_holder.start()
+
+    def resolve(self, url, port, mountpoint, rover_lat, rover_lon, rover_country):
+        """query_ntrip_catalog with the warm catalog and sourcetables."""
+        url = ntrip_query.normalize_url(url, port)
+        # the release of the query, even if a new one is swapped in meanwhile
+        resolver = self.catalog_holder.catalog.resolver(url)
+        if not resolver:
+            return None
+        # the sourcetable is fetched only if the CRS depends on it
+        return resolver.resolve(
+            url,
+            mountpoint,
+            rover_lat,
+            rover_lon,
+            rover_country,
+            cache=self.sourcetable_cache,
+        )
+
+    def respond(self, line):
+        try:
+            if line == "STATS":
+                stats = self.sourcetable_cache.stats()
+                stats["release"] = self.catalog_holder.catalog.release
+                stats["reloads"] = self.catalog_holder.reloads
+                return "OK\t" + json.dumps(stats)
+            url, port, mountpoint, lat, lon, country = line.split("\t")
+            crs = self.resolve(
+                url,
+                port or None,
+                mountpoint or None,
+                _optional_float(lat),
+                _optional_float(lon),
+                country or None,
+            )
+            return "OK\t" + json.dumps(crs)
+        except Exception as e:
+            logger.error(f"query {line!r} failed: {e}")
+            message = str(e) or type(e).__name__
+            return "ERR\t" + " ".join(message.split())
+
+    def server_close(self):
+        super().server_close()
+        self.catalog_holder.stop()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_stale_socket(socket_path):
+    """Removes the socket file of a daemon that did not exit cleanly."""
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+            return
+    raise OSError(f"a query daemon is already running on {socket_path}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Resolve the queries of query.py --daemon with a warm catalog."
+    )
+
+    parser.add_argument(
+        "--socket",
+        type=str,
+        help=f"Unix socket to listen on. Defaults to {ntrip_query.DAEMON_SOCKET}",
+    )
+    parser.add_argument(
+        "--json-path",
+        type=str,
+        help="Location of ntrip-catalog.json. Defaults to ../dist/ntrip-catalog.json",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        help="Seconds a fetched sourcetable is reused",
+        default=300,
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        help=(
+            "Also cache the sourcetables on disk, shared with query.py --max-age,"
+            " and use them if they are younger than these seconds"
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="Directory of the disk cache. Defaults to ../.cache/sourcetables",
+    )
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        help="Seconds between checks of the json for a new release of the catalog",
+        default=5,
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    fetch = None
+    if args.max_age is not None:
+        fetch = ntrip_query.DiskSourcetableCache(args.cache_dir, args.max_age).get
+    with QueryDaemon(
+        args.socket, args.json_path, args.cache_ttl, fetch, args.reload_interval
+    ) as daemon:
+        catalog = daemon.catalog_holder.catalog
+        logger.info(
+            f"Serving {len(catalog)} entries, release {catalog.release},"
+            f" on {daemon.socket_path}"
+        )
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+this script runs a local NTRIP caster that only serves a sourcetable,
+to test and load test the fetch path without network access
+"""
+
+import argparse
+import gzip
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+COUNTRIES = ["DEU", "ESP", "FRA", "ITA", "USA"]
+
+
+def make_sourcetable(str_lines=100):
+    """Returns a sourcetable with str_lines STR lines MP0, MP1, ..."""
+    lines = [
+        "CAS;127.0.0.1;2101;Stub;Stub caster;0;ESP;40.42;-3.70;0.0.0.0;0;",
+        "NET;STUB;Stub;B;N;none;none;none;none;",
+    ]
+    for i in range(str_lines):
+        country = COUNTRIES[i % len(COUNTRIES)]
+        lat = -80 + (i * 7.3) % 160
+        lon = -180 + (i * 13.7) % 360
+        lines.append(
+            f"STR;MP{i};Estación {i};RTCM 3.2;1004(1),1006(10);2;GPS+GLO;STUB;"
+            f"{country};{lat:.2f};{lon:.2f};1;0;sNTRIP;none;B;N;2400;"
+        )
+    lines.append("ENDSOURCETABLE")
+    return "\r\n".join(lines) + "\r\n"
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        try:
+            request = self._read_request()
+            if request is None:
+                return
+            time.sleep(server.latency)
+            self._send(self._response(request))
+        except OSError as e:
+            logger.debug(f"connection closed: {e}")
+
+    def _read_request(self):
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return None
+            data += chunk
+        return data.decode("iso-8859-1")
+
+    def _response(self, request):
+        server = self.server
+        version = server.version
+        if version == "auto":
+            version = "2" if "ntrip/2.0" in request.lower() else "1"
+        body = server.body
+        if version == "2":
+            status = "HTTP/1.1 200 OK\r\nNtrip-Version: Ntrip/2.0\r\n"
+            content_type = "gnss/sourcetable"
+            if server.gzip and "accept-encoding: gzip" in request.lower():
+                body = gzip.compress(body)
+                status += "Content-Encoding: gzip\r\n"
+                with server.lock:
+                    server.compressed += 1
+        else:
+            status = "SOURCETABLE 200 OK\r\n"
+            content_type = "text/plain"
+        head = (
+            f"{status}Server: NTRIP Stub Caster\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode()
+        return head + body
+
+    def _send(self, data):
+        server = self.server
+        if server.drop_after is not None:
+            data = data[: server.drop_after]
+        if server.slowloris:
+            # never finish: one byte at a time, forever
+            for byte in data:
+                self.request.sendall(bytes([byte]))
+                time.sleep(server.slowloris)
+            while True:
+                time.sleep(server.slowloris)
+        if not server.bandwidth:
+            self.request.sendall(data)
+            return
+        chunk_size = max(1, int(server.bandwidth / 10))
+        for start in range(0, len(data), chunk_size):
+            end = start + chunk_size
+            self.request.sendall(data[start:end])
+            time.sleep(chunk_size / server.bandwidth)
+
+    def finish(self):
+        if self.server.drop_after is not None:
+            # reset the connection instead of closing it cleanly
+            linger = struct.pack("ii", 1, 0)
+            self.request.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, linger)
+
+
+class StubCaster(socketserver.ThreadingTCPServer):
+    """
+    Local caster that answers every request with a sourcetable, as a
+    NTRIP v1 "SOURCETABLE 200 OK" or a v2 HTTP response.
+
+    version: "1", "2", or "auto" to answer v2 to requests with Ntrip-Version.
+    str_lines: STR lines of the sourcetable, or `sourcetable` with its text.
+    encoding: of the sourcetable, utf-8 or iso-8859-1.
+    latency: seconds before answering.
+    bandwidth: bytes per second, 0 for unlimited.
+    drop_after: bytes sent before resetting the connection.
+    slowloris: seconds between bytes sent, never finishing the response.
+    gzip: compress v2 responses to requests that accept it.
+
+    Use it as a context manager to serve in a background thread.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        port=0,
+        version="auto",
+        str_lines=100,
+        sourcetable=None,
+        encoding="utf-8",
+        latency=0,
+        bandwidth=0,
+        drop_after=None,
+        slowloris=0,
+        gzip=False,
+    ):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.version = version
+        self.body = (sourcetable or make_sourcetable(str_lines)).encode(encoding)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.drop_after = drop_after
+        self.slowloris = slowloris
+        self.gzip = gzip
+        self.requests = 0
+        self.compressed = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run a local NTRIP caster serving a synthetic sourcetable."
+    )
+
+    parser.add_argument("--port", type=int, help="Port to listen on", default=2101)
+    parser.add_argument(
+        "--version",
+        help="NTRIP version of the responses",
+        choices=["auto", "1", "2"],
+        default="auto",
+    )
+    parser.add_argument(
+        "--str-lines", type=int, help="STR lines of the sourcetable", default=100
+    )
+    parser.add_argument(
+        "--sourcetable", type=str, help="File with the sourcetable to serve instead"
+    )
+    parser.add_argument(
+        "--encoding",
+        help="Encoding of the sourcetable",
+        choices=["utf-8", "iso-8859-1"],
+        default="utf-8",
+    )
+    parser.add_argument(
+        "--latency", type=float, help="Seconds before answering", default=0
+    )
+    parser.add_argument(
+        "--bandwidth", type=int, help="Bytes per second. 0 is unlimited", default=0
+    )
+    parser.add_argument(
+        "--drop-after", type=int, help="Reset the connection after sending N bytes"
+    )
+    parser.add_argument(
+        "--slowloris",
+        type=float,
+        help="Send one byte every N seconds, and never finish",
+        default=0,
+    )
+    parser.add_argument(
+        "--gzip",
+        help="Compress v2 responses to requests that accept it",
+        action="store_true",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    sourcetable = None
+    if args.sourcetable:
+        with open(args.sourcetable) as f:
+            sourcetable = f.read()
+    server = StubCaster(
+        args.port,
+        args.version,
+        args.str_lines,
+        sourcetable,
+        args.encoding,
+        args.latency,
+        args.bandwidth,
+        args.drop_after,
+        args.slowloris,
+        args.gzip,
+    )
+    logger.info(f"Serving a sourcetable of {len(server.body)} bytes on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+this script follows the positions of a moving rover, from NMEA GGA lines,
+and logs the CRS of the mountpoint each time it changes
+"""
+
+import argparse
+import logging
+import math
+import os
+import sys
+from collections import namedtuple
+from functools import reduce
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from scripts import query as ntrip_query  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+CrsChange = namedtuple("CrsChange", ["fix", "lat", "lon", "crs"])
+
+
+def parse_gga(line):
+    """
+    Returns (lat, lon) of a NMEA GGA sentence, or None if it is not a GGA
+    sentence, its checksum is wrong or it has no fix.
+    """
+    line = line.strip()
+    if not line.startswith("$") or line[3:6] != "GGA":
+        return None
+    body, _, checksum = line[1:].partition("*")
+    if checksum:
+        try:
+            if reduce(lambda a, c: a ^ ord(c), body, 0) != int(checksum[:2], 16):
+                return None
+        except ValueError:
+            return None
+    fields = body.split(",")
+    if len(fields) < 7 or fields[6] in ("", "0"):
+        return None
+    try:
+        lat = int(fields[2][:2]) + float(fields[2][2:]) / 60
+        lon = int(fields[4][:3]) + float(fields[4][3:]) / 60
+    except ValueError:
+        return None
+    if fields[3] == "S":
+        lat = -lat
+    if fields[5] == "W":
+        lon = -lon
+    return lat, lon
+
+
+def _lon_gap(lon, west, east):
+    if west <= lon <= east:
+        return 0
+    return min((west - lon) % 360, (lon - east) % 360)
+
+
+def _bbox_margin(lat, lon, boxes):
+    """
+    Returns (inside, margin): if the point is in the boxes, and how many
+    degrees of latitude or longitude it can move keeping it so.
+    """
+    inside = [
+        min(lat - south, north - lat, lon - west, east - lon)
+        for west, south, east, north in boxes
+        if south <= lat <= north and west <= lon <= east
+    ]
+    if inside:
+        return True, max(inside)
+    # to enter a box, both gaps must be closed
+    return False, min(
+        max(south - lat, lat - north, _lon_gap(lon, west, east))
+        for west, south, east, north in boxes
+    )
+
+
+class TrajectoryResolver:
+    """
+    CRS of a mountpoint for a moving rover, as filter_crs would return it at
+    each position, without evaluating it again at every fix.
+
+    The candidate CRSs of the mountpoint are computed once (see
+    crs_candidates). At each evaluation, the distance in degrees to the
+    nearest edge of the rover bboxes that decided the choice is kept. While
+    the rover moves less than that, the CRS cannot change.
+    """
+
+    def __init__(
+        self,
+        json_entry,
+        url,
+        mountpoint,
+        rover_country=None,
+        sourcetable_lines_splitted=None,
+        cache=None,
+    ):
+        self.rover_country = rover_country
+        self.candidates = []
+        for crs in ntrip_query.crs_candidates(
+            json_entry, url, mountpoint, sourcetable_lines_splitted, cache
+        ):
+            boxes = None
+            if "rover_bbox" in crs:
+                boxes = ntrip_query._split_bbox(crs["rover_bbox"])
+            self.candidates.append((boxes, crs))
+        self.crs = None
+        self.fixes = 0
+        self.evaluations = 0
+        self._lat = None
+        self._lon = None
+        self._margin = -1
+
+    def _evaluate(self, lat, lon):
+        self.evaluations += 1
+        margin = math.inf
+        for boxes, crs in self.candidates:
+            if boxes:
+                inside, distance = _bbox_margin(lat, lon, boxes)
+                margin = min(margin, distance)
+                if inside:
+                    return crs, margin
+            elif "rover_countries" in crs:
+                if self.rover_country and self.rover_country in crs["rover_countries"]:
+                    return crs, margin
+            else:
+                return crs, margin
+        return None, margin
+
+    def update(self, lat, lon):
+        """
+        Moves the rover. Returns a CrsChange if the CRS changed, or on the
+        first fix. Otherwise None.
+        """
+        self.fixes += 1
+        if math.isnan(lat) or math.isnan(lon):
+            return None
+        lon = ntrip_query.normalize_lon(lon)
+        if self._lat is not None:
+            moved = max(abs(lat - self._lat), abs((lon - self._lon + 180) % 360 - 180))
+            if moved < self._margin:
+                return None
+        first = self._lat is None
+        crs, margin = self._evaluate(lat, lon)
+        self._lat, self._lon, self._margin = lat, lon, margin
+        if first or crs is not self.crs:
+            self.crs = crs
+            return CrsChange(self.fixes, lat, lon, crs)
+        return None
+
+    def track(self, positions):
+        """Yields the CrsChange of an iterable of (lat, lon)."""
+        for lat, lon in positions:
+            change = self.update(lat, lon)
+            if change:
+                yield change
+
+    def track_nmea(self, lines):
+        """Yields the CrsChange of the GGA sentences among NMEA lines."""
+        return self.track(filter(None, map(parse_gga, lines)))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Log the CRS of a mountpoint along the trajectory of a rover,"
+            " read from NMEA GGA sentences."
+        )
+    )
+
+    parser.add_argument(
+        "--json-path",
+        type=str,
+        help="Location of ntrip-catalog.json. Defaults to ../dist/ntrip-catalog.json",
+    )
+    parser.add_argument(
+        "--url", type=str, help="URL of the NTRIP server", required=True
+    )
+    parser.add_argument("--port", type=int, help="Port of the NTRIP server")
+    parser.add_argument(
+        "--mountpoint", type=str, help="NTRIP server mountpoint", required=True
+    )
+    parser.add_argument("--rover-country", type=str, help="Rover country")
+    parser.add_argument(
+        "--sourcetable",
+        type=str,
+        help="File with the sourcetable. Otherwise it is fetched from the server",
+    )
+    parser.add_argument(
+        "--nmea", type=str, help="File with NMEA sentences. Defaults to stdin"
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    url = ntrip_query.normalize_url(args.url, args.port)
+    entry = ntrip_query.get_catalog(args.json_path, compact=True).search_url(url)
+    if not entry:
+        logger.error(f"{url} not found in the catalog")
+        sys.exit(1)
+    sourcetable = None
+    if args.sourcetable:
+        with open(args.sourcetable) as f:
+            sourcetable = f.read().splitlines()
+    resolver = TrajectoryResolver(
+        entry, url, args.mountpoint, args.rover_country, sourcetable
+    )
+    nmea = open(args.nmea) if args.nmea else sys.stdin
+    with nmea:
+        for change in resolver.track_nmea(nmea):
+            logger.info(f"fix {change.fix} ({change.lat}, {change.lon}): {change.crs}")
+    logger.info(f"{resolver.fixes} fixes, {resolver.evaluations} evaluations")
+
+
+if __name__ == "__main__":
+    main()
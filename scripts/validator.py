@@ -3,10 +3,16 @@ this script validates the json files against the schema
 """
 
 import argparse
+import hashlib
+import importlib.metadata
 import json
 import logging
 import os
 import pathlib
+import tempfile
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
 
 from jsonschema import Draft202012Validator, validators
 
@@ -14,6 +20,12 @@ local_path = pathlib.Path(__file__).parent.parent.resolve().as_posix()
 
 logger = logging.getLogger(__name__)
 
+# below this number of files to validate, a process pool costs more than it saves
+PARALLEL_THRESHOLD = 32
+# schema keys kept in the cache: the data files and the dist, of the current and
+# the previous schemas
+CACHE_SCHEMAS = 4
+
 
 def get_schemas_path(schema_version):
     return os.path.join(local_path, "schemas", schema_version)
@@ -44,15 +56,134 @@ def validate_content(content, filename, checkers):
             checkers["urls"].setdefault(url, []).append(filename)
 
 
-def validate_jsons(input, log_input_files, schema, validate_dist, schemas_uri):
-
+def _schema_key(schema, schemas_uri, validate_dist):
+    """
+    Hash of everything a validation result depends on, but the file content:
+    the schema, the schemas it references, and the jsonschema version.
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps(schema, sort_keys=True).encode())
+    sha.update(f"{validate_dist} {importlib.metadata.version('jsonschema')}".encode())
+    schemas_dir = urllib.request.url2pathname(urlparse(schemas_uri).path)
+    if os.path.isdir(schemas_dir):
+        for path in sorted(pathlib.Path(schemas_dir).glob("*.json")):
+            sha.update(path.read_bytes())
+    return sha.hexdigest()
+
+
+def _read_cache(cache_path):
+    """Returns the cached results, {schema key: {path: record}}."""
+    try:
+        with open(cache_path) as f:
+            schemas = json.load(f)["schemas"]
+        if isinstance(schemas, dict):
+            return schemas
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return {}
+
+
+def _load_cache(cache_path, schema_key):
+    return _read_cache(cache_path).get(schema_key, {})
+
+
+def _save_cache(cache_path, schema_key, files):
+    # the results of the other schema keys, as those of --validate-dist, are kept
+    schemas = _read_cache(cache_path)
+    schemas.pop(schema_key, None)
+    schemas[schema_key] = files
+    while len(schemas) > CACHE_SCHEMAS:
+        del schemas[next(iter(schemas))]  # the least recently saved
+    directory = pathlib.Path(cache_path).parent
+    directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+        json.dump({"schemas": schemas}, f)
+    os.replace(f.name, cache_path)
+
+
+_validator = None
+
+
+def _init_validator(schema, schemas_uri):
+    global _validator
     resolver = validators.RefResolver(base_uri=schemas_uri, referrer=schema)
     Draft202012Validator.check_schema(schema)
-    validator = Draft202012Validator(schema, resolver=resolver)
-
+    _validator = Draft202012Validator(schema, resolver=resolver)
+
+
+def _validate_file(file_path, data, validate_dist):
+    """
+    Validates the json content of a file against the schema of _init_validator.
+    Returns (error, [[name, urls], ...]). error is None if it is valid.
+    """
+    try:
+        content = json.loads(data)
+        if not validate_dist and isinstance(content, dict):
+            content = [content]
+        _validator.validate(instance=content)
+        if validate_dist:
+            content = content["entries"]
+        return None, [[entry["name"], entry["urls"]] for entry in content]
+    except Exception as e:
+        return str(e), None
+
+
+def _read_entries(file_path, data, validate_dist):
+    """
+    Returns the [[name, urls], ...] of a file that is not validated,
+    or [] if it cannot be read.
+    """
+    try:
+        content = json.loads(data)
+        if validate_dist:
+            content = content["entries"]
+        elif isinstance(content, dict):
+            content = [content]
+        return [[entry["name"], entry["urls"]] for entry in content]
+    except Exception:
+        logger.warning(f"{file_path} cannot be read to check names and URLs")
+        return []
+
+
+def _json_files(input, log_input_files):
+    if os.path.isfile(input):
+        return [os.path.abspath(input)]
+
+    file_paths = []
     walk_dir = os.path.abspath(input)
     logger.debug("walk_dir (absolute) = " + walk_dir)
 
+    for root, subdirs, files in os.walk(walk_dir):
+        for filename in files:
+            file_path = os.path.join(root, filename)
+            extension = pathlib.Path(file_path).suffix
+            if extension == ".json":
+                file_paths.append(file_path)
+            elif log_input_files and filename != "release.txt":
+                logger.warning(f"file {file_path} is not JSON")
+    return file_paths
+
+
+def validate_jsons(
+    input,
+    log_input_files,
+    schema,
+    validate_dist,
+    schemas_uri,
+    cache_path=None,
+    jobs=None,
+    others=None,
+):
+    """
+    Validates the json files in the input folder, or the input file, against
+    the schema, and checks that names and URLs are not repeated among files.
+    With a cache_path, the files validated before with the same content and
+    schema are not validated again. Many files are validated in a process pool.
+    The names and URLs are also checked against the files in the others folder,
+    that are not validated.
+    """
+    file_paths = _json_files(input, log_input_files)
+
     ok = True
     failing_files = []
 
@@ -61,30 +192,68 @@ def validate_jsons(input, log_input_files, schema, validate_dist, schemas_uri):
         "names": {},
     }
 
-    for root, subdirs, files in os.walk(walk_dir):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            extension = pathlib.Path(file_path).suffix
-            if extension == ".json":
-                with open(file_path) as f:
-                    content = json.load(f)
-                    if not validate_dist and isinstance(content, dict):
-                        content = [content]
-                    try:
-                        validator.validate(instance=content)
-                        if validate_dist:
-                            content = content["entries"]
-                        validate_content(content, file_path, checkers)
-                        if log_input_files:
-                            logger.info(f"{file_path} -- OK!")
-                    except Exception as e:
-                        logger.error(f"{file_path} -- FAILED!")
-                        ok = False
-                        failing_files.append(file_path)
-                        logger.error("*** >>>>>\n", e, "\n*** <<<<<")
+    schema_key = _schema_key(schema, schemas_uri, validate_dist) if cache_path else None
+    cached = _load_cache(cache_path, schema_key) if cache_path else {}
+    validated_files = {}
+    results = {}
+    to_validate = []
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            data = f.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        record = cached.get(file_path)
+        if record and record["sha256"] == sha256:
+            results[file_path] = None, record["entries"]
+        else:
+            to_validate.append((file_path, data))
+        validated_files[file_path] = {"sha256": sha256}
+
+    if others:
+        for file_path in _json_files(others, False):
+            if file_path in validated_files:
+                continue
+            with open(file_path, "rb") as f:
+                data = f.read()
+            record = cached.get(file_path)
+            if record and record["sha256"] == hashlib.sha256(data).hexdigest():
+                entries = record["entries"]
+            else:
+                entries = _read_entries(file_path, data, validate_dist)
+            content = [{"name": name, "urls": urls} for name, urls in entries]
+            validate_content(content, file_path, checkers)
+
+    if to_validate:
+        paths, datas = zip(*to_validate)
+        dists = [validate_dist] * len(paths)
+        if len(to_validate) >= PARALLEL_THRESHOLD and jobs != 1:
+            with ProcessPoolExecutor(
+                jobs, initializer=_init_validator, initargs=(schema, schemas_uri)
+            ) as executor:
+                validated = executor.map(_validate_file, paths, datas, dists)
+                results.update(zip(paths, validated))
+        else:
+            _init_validator(schema, schemas_uri)
+            results.update(zip(paths, map(_validate_file, paths, datas, dists)))
+    logger.debug(f"{len(to_validate)} of {len(file_paths)} json files validated")
+
+    for file_path in file_paths:
+        error, entries = results[file_path]
+        if error is None:
+            content = [{"name": name, "urls": urls} for name, urls in entries]
+            validate_content(content, file_path, checkers)
+            validated_files[file_path]["entries"] = entries
+            if log_input_files:
+                logger.info(f"{file_path} -- OK!")
+        else:
+            logger.error(f"{file_path} -- FAILED!")
+            ok = False
+            failing_files.append(file_path)
+            del validated_files[file_path]
+            logger.error(f"*** >>>>>\n{error}\n*** <<<<<")
 
-            elif log_input_files and filename != "release.txt":
-                logger.warning(f"file {file_path} is not JSON")
+    if cache_path:
+        # keep the results of other files, to validate single files in between
+        _save_cache(cache_path, schema_key, {**cached, **validated_files})
 
     for k, v in checkers["names"].items():
         if len(v) > 1:
@@ -99,7 +268,8 @@ def validate_jsons(input, log_input_files, schema, validate_dist, schemas_uri):
             logger.error(f"URL {k} is used in several files: {files}")
 
     if len(failing_files) > 0:
-        logger.error("\n*** Failing files: \n", "\n".join(failing_files), "\n")
+        failing = "\n".join(failing_files)
+        logger.error(f"\n*** Failing files: \n{failing}\n")
     return ok
 
 
@@ -114,7 +284,10 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--input-dist",
         type=str,
-        help="Folder containing the aggregated json data. Defaults to ../dist",
+        help=(
+            "Folder containing the aggregated json data, ntrip-catalog.json."
+            " Defaults to ../dist"
+        ),
     )
     parser.add_argument(
         "--validate-dist",
@@ -134,7 +307,26 @@ def parse_args() -> argparse.Namespace:
         help="Version of the schema",
         default="v0.2",
     )
-    parser.add_argument("--single-file", help="Validate a single file")  # TB done
+    parser.add_argument(
+        "--single-file",
+        help="Validate a single file, instead of the --input or --input-dist folder",
+    )
+    parser.add_argument(
+        "--cache",
+        help="Do not validate again the files that did not change since last run",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser.add_argument(
+        "--cache-path",
+        type=str,
+        help="Cache of the validated files. Defaults to ../.cache/validator.json",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of processes to validate the files. Defaults to the CPUs",
+    )
 
     return parser.parse_args()
 
@@ -146,15 +338,37 @@ def main():
         input = args.input_dist
         if not input:
             input = os.path.join(local_path, "dist")
+        # make_dist may also write there the compact artifacts and the shards,
+        # that are not catalogs
+        if os.path.isdir(input):
+            input = os.path.join(input, "ntrip-catalog.json")
         schema = get_global_schema(args.schema_version)
     else:
         input = args.input
         if not input:
             input = os.path.join(local_path, "data")
         schema = get_entries_schema(args.schema_version)
+    others = None
+    if args.single_file:
+        # the names and URLs of the single file are checked against the others
+        if not args.validate_dist:
+            others = input
+        input = args.single_file
+    cache_path = None
+    if args.cache:
+        cache_path = args.cache_path or os.path.join(
+            local_path, ".cache", "validator.json"
+        )
     schemas_uri = pathlib.Path(get_schemas_path(args.schema_version)).as_uri() + "/"
     if not validate_jsons(
-        input, args.log_input_files, schema, args.validate_dist, schemas_uri
+        input,
+        args.log_input_files,
+        schema,
+        args.validate_dist,
+        schemas_uri,
+        cache_path,
+        args.jobs,
+        others,
     ):
         raise Exception("Some failures validating data")
 
@@ -1,7 +1,27 @@
+import gzip
 import json
+import logging
+import os
+import pathlib
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock
 
+import pycurl
+import pytest
+
+from benchmarks import synthetic
+from scripts import harvester, make_dist
 from scripts import query as ntrip_query
+from scripts import query_daemon, stub_caster, trajectory, validator
+from web import tiny_server
 
 server_path = "scripts.query.get_streams_from_server"
 
@@ -145,3 +165,1145 @@ def test_rover_antimeridian():
 
     crs = ntrip_query.filter_crs(entry, url, "POLARIS_LOCAL", 10, -140)
     assert crs is None
+
+
+def test_catalog_search_url():
+    json_data = ntrip_query.load_json()
+    catalog = ntrip_query.Catalog(json_data)
+    assert catalog.release == json_data["release"]
+    for entry in json_data["entries"]:
+        for url in entry["urls"]:
+            assert catalog.search_url(url) is ntrip_query.search_url_in_data(
+                url, json_data
+            )
+    assert catalog.search_url("http://unknown.example.com:2101") is None
+    assert catalog.search_url("not a url") is None
+
+    entry = catalog.search_url("http://ergnss-tr.ign.es:2101")
+    assert entry
+    assert catalog.search_url("ergnss-tr.ign.es") is entry
+    assert catalog.search_url("HTTP://ERGNSS-TR.IGN.ES") is entry
+    assert catalog.search_url("ergnss-tr.ign.es", 2101) is entry
+    assert ntrip_query.search_url_in_data("ergnss-tr.ign.es", catalog) is entry
+
+
+def test_catalog_search_host():
+    catalog = ntrip_query.Catalog(ntrip_query.load_json())
+    entry = catalog.search_url("https://polaris.pointonenav.com:2102")
+    assert entry
+    assert catalog.search_host_port("polaris.pointonenav.com", 2102) == [entry]
+    assert entry in catalog.search_host("Polaris.PointOneNav.com")
+    assert catalog.search_host("unknown.example.com") == []
+
+
+def test_normalize_url():
+    assert ntrip_query.normalize_url("vrsnow.de") == "http://vrsnow.de:2101"
+    assert ntrip_query.normalize_url("vrsnow.de", 2102) == "http://vrsnow.de:2102"
+    assert ntrip_query.normalize_url("https://vrsnow.de:443") == "https://vrsnow.de:443"
+    assert ntrip_query.normalize_url("http://[::1]:2101") == "http://[::1]:2101"
+
+
+def test_sourcetable_cache():
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return ["STR;" + url + ";" + "x" * 10]
+
+    cache = ntrip_query.SourcetableCache(ttl=60, max_bytes=100, fetch=fetch)
+    assert cache.get("a") == ["STR;a;xxxxxxxxxx"]
+    assert cache.get("a") == ["STR;a;xxxxxxxxxx"]
+    assert fetched == ["a"]
+    for url in "bcdefg":
+        cache.get(url)
+    # 17 bytes per sourcetable, so only 5 fit and "a" is the least recently used
+    stats = cache.stats()
+    assert stats["entries"] == 5
+    assert stats["evictions"] == 2
+    assert stats["hits"] == 1
+    assert stats["misses"] == 7
+    cache.get("a")
+    assert fetched.count("a") == 2
+
+    cache = ntrip_query.SourcetableCache(ttl=0, fetch=fetch)
+    cache.get("a")
+    cache.get("a")
+    assert cache.stats()["misses"] == 2
+
+
+def test_sourcetable_cache_coalescing():
+    release = threading.Event()
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        release.wait(5)
+        return ["STR;MP;"]
+
+    cache = ntrip_query.SourcetableCache(fetch=fetch)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get("a")))
+        for _ in range(20)
+    ]
+    for t in threads:
+        t.start()
+    while cache.stats()["coalesced"] < 19:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join()
+    assert fetched == ["a"]
+    assert results == [["STR;MP;"]] * 20
+
+
+def test_disk_sourcetable_cache(tmp_path):
+    url = "http://caster.example.com:2101"
+    versions = iter([["STR;A;"], ["STR;B;"], ["STR;C;"]])
+
+    with mock.patch(server_path, side_effect=lambda url: next(versions)) as mokked:
+        cache = ntrip_query.DiskSourcetableCache(tmp_path, max_age=60)
+        assert cache.get(url).lines == ["STR;A;"]
+        # another process reads it from disk
+        other = ntrip_query.DiskSourcetableCache(tmp_path, max_age=60)
+        assert other.get(url).lines == ["STR;A;"]
+        assert mokked.call_count == 1
+
+        # stale: returned while it is fetched again in the background
+        other = ntrip_query.DiskSourcetableCache(tmp_path, max_age=0, stale=60)
+        assert other.get(url).lines == ["STR;A;"]
+        for _ in range(100):
+            if not pathlib.Path(other.path(url) + ".lock").exists():
+                break
+            time.sleep(0.01)
+        assert mokked.call_count == 2
+        assert cache.get(url).lines == ["STR;B;"]
+
+        # expired
+        other = ntrip_query.DiskSourcetableCache(tmp_path, max_age=0)
+        assert other.get(url).lines == ["STR;C;"]
+        assert mokked.call_count == 3
+
+    offline = ntrip_query.DiskSourcetableCache(tmp_path, max_age=0, offline=True)
+    assert offline.get(url).lines == ["STR;C;"]
+    with pytest.raises(LookupError):
+        offline.get("http://other.example.com:2101")
+    # malformed records are misses
+    for record in ["{", "[]", '{"url": "x"}', json.dumps({"lines": [1]})]:
+        pathlib.Path(cache.path(url)).write_text(record)
+        with pytest.raises(LookupError):
+            offline.get(url)
+
+    # a failed write leaves no temporary file
+    with mock.patch(server_path, return_value=["STR;D;"]), mock.patch(
+        "json.dump", side_effect=OSError("disk full")
+    ), pytest.raises(OSError):
+        cache.fetch(url)
+    assert os.listdir(tmp_path) == [os.path.basename(cache.path(url))]
+
+    # memory over disk
+    memory = ntrip_query.SourcetableCache(fetch=offline.get)
+    pathlib.Path(cache.path(url)).unlink()
+    with mock.patch(server_path, return_value=["STR;D;"]):
+        cache.fetch(url)
+    assert memory.get(url).lines == ["STR;D;"]
+
+
+def test_disk_sourcetable_cache_detached_refresh(tmp_path):
+    # the refresh of a command line query runs in its own process
+    with stub_caster.StubCaster(str_lines=3) as caster:
+        cache = ntrip_query.DiskSourcetableCache(
+            tmp_path, max_age=0, stale=60, detached=True
+        )
+        lines = cache.fetch(caster.url).lines
+        with mock.patch("threading.Thread") as thread:
+            assert cache.get(caster.url).lines == lines
+        thread.assert_not_called()
+        for _ in range(500):
+            if caster.requests == 2 and not os.path.exists(
+                cache.path(caster.url) + ".lock"
+            ):
+                break
+            time.sleep(0.01)
+        assert caster.requests == 2
+        assert not os.path.exists(cache.path(caster.url) + ".lock")
+
+
+def test_filter_crs_with_cache():
+    url = "http://ergnss-tr.ign.es:2102"
+    entry = ntrip_query.get_catalog().search_url(url)
+    cache = ntrip_query.SourcetableCache()
+    with mock.patch(
+        server_path, side_effect=mock_server("./tests/data/ign_es.json")
+    ) as mokked:
+        crs = ntrip_query.filter_crs(entry, url, "VCIA3M", 0, 0, cache=cache)
+        assert crs["id"] == "EPSG:7931"
+        crs = ntrip_query.filter_crs(entry, url, "IZAN3M", 0, 0, cache=cache)
+        assert crs["id"] == "EPSG:4080"
+    mokked.assert_called_once()
+
+
+def test_sourcetable():
+    with open("./tests/data/ign_es.json") as f:
+        lines = json.load(f)["http://ergnss-tr.ign.es:2102"]
+    sourcetable = ntrip_query.Sourcetable(lines)
+    assert len(sourcetable) == len(lines)
+    assert "IZAN3M" in sourcetable.mountpoints
+    record = sourcetable.get("IZAN3M")
+    assert record.fields == ntrip_query.get_str_line_from_server(lines, "IZAN3M")
+    assert ntrip_query.get_str_line_from_server(sourcetable, "IZAN3M") == record.fields
+    assert record.country == "ESP"
+    assert 28 < record.lat < 29
+    assert -17 < record.lon < -16
+    assert sourcetable.get("UNKNOWN") is None
+    assert sourcetable.digest == ntrip_query.Sourcetable(lines).digest
+    assert sourcetable.digest != ntrip_query.Sourcetable(lines[1:]).digest
+
+    catalog = ntrip_query.get_catalog()
+    url = "http://ergnss-tr.ign.es:2102"
+    entry = catalog.search_url(url)
+    with mock.patch(server_path) as mokked:
+        crs = ntrip_query.filter_crs(entry, url, "IZAN3M", 0, 0, None, sourcetable)
+        assert crs["id"] == "EPSG:4080"
+        crs = ntrip_query.filter_crs(entry, url, "VCIA3M", 0, 0, None, lines)
+        assert crs["id"] == "EPSG:7931"
+    mokked.assert_not_called()
+
+
+def test_filter_crs_batch():
+    mock_data = {}
+    for filename in ["./tests/data/ign_es.json", "./tests/data/vrsnow.de.json"]:
+        with open(filename) as f:
+            mock_data.update(json.load(f))
+
+    catalog = ntrip_query.get_catalog()
+    urls = [
+        "http://ergnss-tr.ign.es:2101",
+        "http://ergnss-tr.ign.es:2102",
+        "http://vrsnow.de:2101",
+        "http://rtk.topnetlive.com:2101",
+        "http://polaris.pointonenav.com:2101",
+        "http://unknown.example.com:2101",
+    ]
+    mountpoints = ["CERCANA3", "VCIA3M", "IZAN3M", "TVN_RTCM_31", "NET_MSM5"]
+    mountpoints += ["POLARIS_LOCAL", "UNKNOWN"]
+    countries = [None, "CHE", "DEU", "JPN", "ESP"]
+    rng = random.Random(4)
+    rows = [
+        (
+            rng.choice(urls),
+            rng.choice(mountpoints),
+            rng.uniform(-90, 90),
+            rng.uniform(-540, 540),
+            rng.choice(countries),
+        )
+        for _ in range(2000)
+    ]
+    # points on the edges of the Hawaii antimeridian box
+    rows += [(urls[4], "POLARIS_LOCAL", 10, lon, None) for lon in (157.47, -151.27)]
+    rows += [(urls[4], "POLARIS_LOCAL", lat, 180, None) for lat in (-17.56, 31.8)]
+
+    with mock.patch(server_path, side_effect=mock_data.__getitem__) as mokked:
+        expected = [
+            (
+                ntrip_query.filter_crs(catalog.search_url(row[0]), *row)
+                if catalog.search_url(row[0])
+                else None
+            )
+            for row in rows
+        ]
+        mokked.reset_mock()
+        result = ntrip_query.filter_crs_batch(catalog, *zip(*rows))
+        assert mokked.call_count == 2  # once per URL needing the sourcetable
+
+    assert result == expected
+    assert sum(crs is not None for crs in result) > 100
+
+
+def test_entry_resolver():
+    data = synthetic.synthetic_catalog(200, seed=3)
+    sourcetable = ntrip_query.Sourcetable(synthetic.synthetic_sourcetable(150, seed=3))
+    catalog = ntrip_query.Catalog(data)
+    rng = random.Random(5)
+    for entry in data["entries"]:
+        url = entry["urls"][0]
+        resolver = catalog.resolver(url)
+        assert resolver is catalog.resolver(url)
+        for _ in range(50):
+            row = (
+                url,
+                f"MP{rng.randrange(110)}",
+                rng.uniform(-90, 90),
+                rng.uniform(-540, 540),
+                rng.choice([None, "", "CHE", "DEU", "ESP", "USA"]),
+                sourcetable,
+            )
+            assert resolver.resolve(*row) == ntrip_query.filter_crs(entry, *row)
+    assert catalog.resolver("http://unknown.example.com:2101") is None
+
+    # real entries, fetching the sourcetable only when needed
+    mock_data = {}
+    for filename in ["./tests/data/ign_es.json", "./tests/data/vrsnow.de.json"]:
+        with open(filename) as f:
+            mock_data.update(json.load(f))
+    catalog = ntrip_query.get_catalog()
+    rows = [
+        ("http://ergnss-tr.ign.es:2101", "CERCANA3", 40, -3, None),
+        ("http://ergnss-tr.ign.es:2102", "IZAN3M", 28.3, -16.5, None),
+        ("http://ergnss-tr.ign.es:2102", "VCIA3M", 39.5, -0.4, None),
+        ("http://vrsnow.de:2101", "NET_MSM5", 47, 8, "CHE"),
+        ("http://vrsnow.de:2101", "NET_MSM5", 47, 8, "DEU"),
+        ("http://polaris.pointonenav.com:2101", "POLARIS_LOCAL", 20, -157, None),
+    ]
+    for row in rows:
+        entry = catalog.search_url(row[0])
+        with mock.patch(server_path, side_effect=mock_data.__getitem__) as mokked:
+            expected = ntrip_query.filter_crs(entry, *row)
+            calls = mokked.call_count
+            assert catalog.resolver(row[0]).resolve(*row) == expected
+            assert mokked.call_count == 2 * calls
+
+
+def test_resolve_all_mountpoints():
+    data = synthetic.synthetic_catalog(100, seed=6)
+    lines = synthetic.synthetic_sourcetable(120, seed=6)
+    lines.insert(1, "STR;SHORT;")
+    lines.insert(1, "STR;BADPOS;;;;;;;;north;east;")
+    sourcetable = ntrip_query.Sourcetable(lines)
+    rng = random.Random(7)
+    for entry in data["entries"]:
+        url = entry["urls"][0]
+        table = ntrip_query.resolve_all_mountpoints(entry, url, sourcetable)
+        assert list(table) == sourcetable.mountpoints
+        for mountpoint, crss in table.items():
+            if mountpoint == "BADPOS":
+                continue  # filter_crs raises, the table does not match the bboxes
+            lat, lon = rng.uniform(-90, 90), rng.uniform(-540, 540)
+            country = rng.choice([None, "DEU", "ESP", "USA"])
+            row = (url, mountpoint, lat, lon, country, sourcetable)
+            assert ntrip_query.filter_by_rover(
+                crss, lat, lon, country
+            ) == ntrip_query.filter_crs(entry, *row)
+
+    with open("./tests/data/ign_es.json") as f:
+        mock_data = json.load(f)
+    url = "http://ergnss-tr.ign.es:2102"
+    entry = ntrip_query.get_catalog().search_url(url)
+    with mock.patch(server_path, side_effect=mock_data.__getitem__) as mokked:
+        table = ntrip_query.resolve_all_mountpoints(entry, url)
+        assert mokked.call_count == 1
+    assert table["IZAN3M"] != table["VCIA3M"]
+
+
+def test_catalog_covering():
+    catalog = ntrip_query.get_catalog()
+
+    def brute_force(lat, lon):
+        res = set()
+        for entry in catalog.entries:
+            for stream in entry["streams"]:
+                bboxes = []
+                if stream["filter"] != "all":
+                    bboxes = stream["filter"].get("lat_lon_bboxes", [])
+                for crs in stream["crss"]:
+                    for bbox in bboxes + [crs.get("rover_bbox")]:
+                        if bbox and ntrip_query.point_in_bbox(lat, lon, bbox):
+                            res.add((id(entry), id(stream), id(crs)))
+        return res
+
+    rng = random.Random(5)
+    points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(500)]
+    points += [(10, 170), (10, -170), (10, 180), (31.8, -151.27), (28, -16)]
+    for lat, lon in points:
+        covering = catalog.covering(lat, lon)
+        found = {(id(c.entry), id(c.stream), id(c.crs)) for c in covering}
+        assert len(found) == len(covering)
+        assert found == brute_force(lat, lon)
+
+    names = {c.crs["name"] for c in catalog.covering(10, -170)}
+    assert "NAD83(PA11)" in names
+    names = {c.crs["name"] for c in catalog.covering(28, -16)}
+    assert "REGCAN95" in names
+
+
+def test_harvest():
+    sourcetable = "STR;MP1;;;;;;;ESP;40.0;-3.0;\r\nENDSOURCETABLE\r\n"
+    concurrent = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                concurrent["now"] += 1
+                concurrent["max"] = max(concurrent["max"], concurrent["now"])
+            time.sleep(0.1)
+            with lock:
+                concurrent["now"] -= 1
+            body = sourcetable.encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), Handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+        urls = [f"http://127.0.0.1:{port}/?{i}" for i in range(4)]
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            closed_url = f"http://127.0.0.1:{s.getsockname()[1]}"
+        results = harvester.harvest(urls + [closed_url], max_per_host=2)
+        server.shutdown()
+
+    assert concurrent["max"] == 2
+    for url in urls:
+        assert results[url].error is None
+        assert results[url].lines == sourcetable.splitlines()
+        assert results[url].elapsed >= 0.1
+    assert isinstance(results[closed_url].error, pycurl.error)
+    assert results[closed_url].lines is None
+
+
+def test_make_dist_incremental(tmp_path):
+    data = tmp_path / "data"
+    for i, entry in enumerate(ntrip_query.load_json()["entries"]):
+        folder = data / str(i % 5)
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"{i}.json").write_text(json.dumps(entry, indent=4))
+    (data / "release.txt").write_text("# comment\n7\n")
+    manifest = tmp_path / "manifest.json"
+
+    def dumps(final):
+        return json.dumps(final, indent=4)
+
+    full = dumps(make_dist.read_json(str(data), False))
+    with mock.patch.object(make_dist, "PARALLEL_THRESHOLD", 1):
+        assert dumps(make_dist.read_json(str(data), False, manifest)) == full
+
+    with mock.patch.object(make_dist, "_parse_file", wraps=make_dist._parse_file) as p:
+        assert dumps(make_dist.read_json(str(data), False, manifest)) == full
+        p.assert_not_called()
+
+        changed = next(data.rglob("*.json"))
+        content = json.loads(changed.read_text())
+        entry = content[0] if isinstance(content, list) else content
+        entry["name"] = "0 changed"
+        changed.write_text(json.dumps(content))
+        (data / "new.json").write_text(json.dumps({**entry, "name": "1 new"}))
+        res = make_dist.read_json(str(data), False, manifest)
+        assert p.call_count == 2
+
+    assert dumps(res) == dumps(make_dist.read_json(str(data), False))
+    assert [e["name"] for e in res["entries"][:2]] == ["0 changed", "1 new"]
+
+
+def test_compact_catalog(tmp_path):
+    full = ntrip_query.load_json(compact=False)
+    path = str(tmp_path / "ntrip-catalog.json")
+    with open(path, "w") as f:
+        json.dump(full, f, indent=4)
+    make_dist.write_compact(full, path)
+    min_json_path, snapshot_path = ntrip_query.compact_paths(path)
+
+    compact = ntrip_query.load_json(path, compact=True)
+    assert compact["release"] == full["release"]
+    assert "urls" in compact
+    assert "description" not in compact["entries"][0]
+    assert ntrip_query.load_json(path) == full
+    # make_dist writes what query.py would build
+    assert compact["urls"] == ntrip_query.build_url_table(compact["entries"])
+    assert make_dist.compact_paths(path) == (min_json_path, snapshot_path)
+    holder = ntrip_query.CatalogHolder(path, compact=True)
+    assert "description" not in holder.catalog.entries[0]
+    full_catalog = ntrip_query.Catalog(full)
+    compact_catalog = ntrip_query.Catalog(compact)
+    rng = random.Random(6)
+    # the same empty sourcetable for the streams filtered by the STR lines
+    with mock.patch(server_path, return_value=[]):
+        for entry in full["entries"]:
+            for url in entry["urls"]:
+                compact_entry = compact_catalog.search_url(url)
+                assert compact_entry["name"] == entry["name"]
+                for _ in range(20):
+                    lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+                    crs = ntrip_query.filter_crs(entry, url, "", lat, lon, "DEU")
+                    compact_crs = ntrip_query.filter_crs(
+                        compact_entry, url, "", lat, lon, "DEU"
+                    )
+                    assert crs == compact_crs
+    assert len(full_catalog.covering(10, 170)) == len(compact_catalog.covering(10, 170))
+
+    # a broken snapshot falls back to the minified json
+    with open(snapshot_path, "wb") as f:
+        f.write(b"broken")
+    assert ntrip_query.load_json(path, compact=True) == compact
+
+    # compact artifacts of another version of the json are ignored,
+    # even with the same release
+    with open(path, "w") as f:
+        json.dump({**full, "entries": full["entries"][:3]}, f, indent=4)
+    loaded = ntrip_query.load_json(path, compact=True)
+    assert "urls" not in loaded and len(loaded["entries"]) == 3
+
+
+def test_validate_jsons_cache(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    entries = ntrip_query.load_json(compact=False)["entries"]
+    for i, entry in enumerate(entries):
+        (data / f"{i}.json").write_text(json.dumps(entry, indent=4))
+    schema = validator.get_entries_schema("v0.2")
+    schemas_uri = pathlib.Path(validator.get_schemas_path("v0.2")).as_uri() + "/"
+    cache = tmp_path / "cache.json"
+
+    def validate(input, **kwargs):
+        return validator.validate_jsons(
+            str(input), False, schema, False, schemas_uri, cache, **kwargs
+        )
+
+    with mock.patch.object(validator, "PARALLEL_THRESHOLD", 1):
+        assert validate(data)
+    with mock.patch.object(
+        validator, "_validate_file", wraps=validator._validate_file
+    ) as validate_file:
+        assert validate(data)
+        validate_file.assert_not_called()
+
+        # the results of the dist are cached apart, both are kept
+        dist = tmp_path / "ntrip-catalog.json"
+        dist.write_text(json.dumps(ntrip_query.load_json()))
+        dist_schema = validator.get_global_schema("v0.2")
+        for _ in range(2):
+            assert validator.validate_jsons(
+                str(dist), False, dist_schema, True, schemas_uri, cache
+            )
+            assert validate(data)
+        validate_file.assert_called_once()
+        validate_file.reset_mock()
+
+        # duplicated urls are found also among cached files
+        (data / "copy.json").write_text(json.dumps({**entries[0], "name": "copy"}))
+        assert not validate(data)
+        validate_file.assert_called_once()
+        # and among the other files when a single file is validated
+        assert validate(data / "copy.json")
+        assert not validate(data / "copy.json", others=data)
+        (data / "copy.json").unlink()
+
+        (data / "0.json").write_text(json.dumps({**entries[0], "urls": "wrong"}))
+        assert not validate(data / "0.json")
+        assert validate(data / "1.json")
+        assert not validate(data)
+
+
+def test_validator_single_file(tmp_path):
+    geodnet = pathlib.Path(validator.local_path, "data", "World", "geodnet.json")
+    copy = tmp_path / "copy.json"
+    entry = json.loads(geodnet.read_text())[0]
+    copy.write_text(json.dumps([{**entry, "name": "Dup copy"}]))
+    argv = ["validator.py", "--no-cache", "--single-file"]
+    for single_file in [geodnet, copy]:
+        with mock.patch.object(sys, "argv", argv + [str(single_file)]):
+            if single_file == copy:
+                with pytest.raises(Exception, match="Some failures"):
+                    validator.main()
+            else:
+                validator.main()
+
+
+def test_query_ntrip_catalog_fetches_lazily(tmp_path):
+    url = "http://ntrip.reseau-orpheon.fr:8500"
+
+    def query(*options):
+        argv = ["query.py", "--url", url, "--cache-dir", str(tmp_path)]
+        with mock.patch.object(sys, "argv", argv + list(options)):
+            return ntrip_query.query_ntrip_catalog(ntrip_query.parse_args())
+
+    error = pycurl.error(pycurl.E_COULDNT_RESOLVE_HOST, "no network")
+    with mock.patch(server_path, side_effect=error), mock.patch(
+        "scripts.query.get_str_line_streaming", side_effect=error
+    ) as streaming:
+        # the stream filtered by mountpoint decides, the caster is not needed
+        for options in [[], ["--no-streaming"], ["--max-age", "60"]]:
+            crs = query("--mountpoint", "RRAF91_i-MAX_3.0_GG", *options)
+            assert crs["name"] == "RRAF 1991"
+        with pytest.raises(pycurl.error):
+            query("--mountpoint", "OTHER", "--rover-lat", "45", "--rover-lon", "2")
+
+        streaming.reset_mock(side_effect=True)
+        streaming.return_value = None
+        assert query("--mountpoint", "OTHER") is None
+        streaming.assert_called_once_with(url, "OTHER", None)
+
+
+def test_query_offline_not_cached(tmp_path, caplog):
+    argv = ["query.py", "--url", "http://ntrip.reseau-orpheon.fr:8500"]
+    argv += ["--mountpoint", "OTHER", "--offline", "--cache-dir", str(tmp_path)]
+    with mock.patch.object(sys, "argv", argv), pytest.raises(SystemExit):
+        ntrip_query.main()
+    assert "No cached sourcetable of http://ntrip.reseau-orpheon.fr:8500" in caplog.text
+
+
+def test_validate_dist(tmp_path):
+    data = ntrip_query.load_json()
+    path = str(tmp_path / "ntrip-catalog.json")
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+    make_dist.write_compact(data, path)
+    make_dist.write_shards(data, str(tmp_path / "shards"))
+    argv = ["validator.py", "--validate-dist", "--input-dist", str(tmp_path)]
+    with mock.patch.object(sys, "argv", argv + ["--no-cache"]):
+        validator.main()
+
+
+def test_get_str_line_streaming():
+    lines = [f"STR;MP{i};;;;;;;ESP;40.0;-3.0;" for i in range(2000)]
+    lines += ["STR;Añón;;;;;;;ESP;41.0;-3.0;", "ENDSOURCETABLE", "STR;AFTER;"]
+    sent = []
+    # the chunks after the first one wait for it
+    proceed = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        encoding = "utf-8"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.end_headers()
+            try:
+                for start in range(0, len(lines), 500):
+                    if start:
+                        proceed.wait(5)
+                    sent.append(start)
+                    end = start + 500
+                    chunk = "\r\n".join(lines[start:end]) + "\r\n"
+                    self.wfile.write(chunk.encode(self.encoding))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), Handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        line = ntrip_query.get_str_line_streaming(url, "MP10")
+        assert line == lines[10].split(";")
+        # aborted after the first chunk, the others were not needed
+        assert sent == [0]
+        proceed.set()
+
+        line = ntrip_query.get_str_line_streaming(url, "Añón")
+        assert line and line[1] == "Añón"
+        Handler.encoding = "iso-8859-1"
+        line = ntrip_query.get_str_line_streaming(url, "Añón")
+        assert line and line[1] == "Añón"
+
+        assert ntrip_query.get_str_line_streaming(url, "AFTER") is None
+        server.shutdown()
+
+
+def test_sharded_catalog(tmp_path):
+    data = ntrip_query.load_json(compact=False)
+    catalog = ntrip_query.Catalog(data)
+    (tmp_path / "entries").mkdir()
+    (tmp_path / "entries" / "stale.json").write_text("{}")
+    make_dist.write_shards(data, str(tmp_path))
+    assert not (tmp_path / "entries" / "stale.json").exists()
+    assert len(list((tmp_path / "entries").iterdir())) == len(data["entries"])
+
+    sharded = ntrip_query.ShardedCatalog(str(tmp_path / "manifest.json"))
+    assert sharded.release == data["release"]
+    for entry in data["entries"]:
+        for url in entry["urls"]:
+            assert sharded.search_url(url) == catalog.search_url(url)
+    assert sharded.search_url("ergnss-tr.ign.es", 2102)["name"] == (
+        catalog.search_url("http://ergnss-tr.ign.es:2102")["name"]
+    )
+    assert sharded.search_url("http://unknown.example.com:2101") is None
+
+
+def test_synthetic_data_is_valid(tmp_path):
+    catalog = synthetic.synthetic_catalog(50)
+    synthetic.write_data_tree(catalog, str(tmp_path))
+    schema = validator.get_entries_schema("v0.2")
+    schemas_uri = pathlib.Path(validator.get_schemas_path("v0.2")).as_uri() + "/"
+    assert validator.validate_jsons(str(tmp_path), False, schema, False, schemas_uri)
+    assert make_dist.read_json(str(tmp_path), False)["entries"] == sorted(
+        catalog["entries"], key=lambda x: x["name"]
+    )
+
+    sourcetable = ntrip_query.Sourcetable(synthetic.synthetic_sourcetable(100))
+    assert len(sourcetable.mountpoints) == 100
+    assert -180 <= sourcetable.get("MP99").lon <= 180
+
+
+def test_stub_caster():
+    for version in ["1", "2"]:
+        for encoding in ["utf-8", "iso-8859-1"]:
+            with stub_caster.StubCaster(
+                version=version, str_lines=300, encoding=encoding
+            ) as caster:
+                sourcetable = ntrip_query.Sourcetable(
+                    ntrip_query.get_streams_from_server(caster.url)
+                )
+            assert len(sourcetable.records) == 300
+            assert sourcetable.get("MP7").fields[2] == "Estación 7"
+
+    # a v2 response knows its length, a v1 response cannot tell it was cut
+    with stub_caster.StubCaster(version="2", drop_after=500) as caster:
+        with pytest.raises(pycurl.error):
+            ntrip_query.get_streams_from_server(caster.url)
+    with stub_caster.StubCaster(version="1", drop_after=500) as caster:
+        lines = ntrip_query.get_streams_from_server(caster.url)
+        assert "ENDSOURCETABLE" not in lines
+        assert caster.requests == 1
+
+    # the delays are lower bounds, whatever the load of the machine
+    with stub_caster.StubCaster(str_lines=5, latency=0.3) as caster:
+        start = time.monotonic()
+        ntrip_query.get_streams_from_server(caster.url)
+        assert time.monotonic() - start >= 0.3
+    with stub_caster.StubCaster(str_lines=20, bandwidth=5000) as caster:
+        start = time.monotonic()
+        ntrip_query.get_streams_from_server(caster.url)
+        # the client has it all once the last chunk of 5000 / 10 bytes is sent
+        assert time.monotonic() - start >= (len(caster.body) - 500) / 5000
+
+    # at most one byte every 0.05 s, and the response never ends
+    with stub_caster.StubCaster(str_lines=5, slowloris=0.05) as caster:
+        with socket.create_connection(caster.server_address) as sock:
+            sock.sendall(b"GET / HTTP/1.1\r\nNtrip-Version: Ntrip/2.0\r\n\r\n")
+            sock.settimeout(0.1)
+            received = b""
+            start = time.monotonic()
+            while time.monotonic() - start < 0.5:
+                try:
+                    chunk = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                assert chunk, "the connection was closed"
+                received += chunk
+            elapsed = time.monotonic() - start
+        assert 0 < len(received) <= elapsed / 0.05 + 1
+
+
+def test_tiny_server_metrics():
+    tiny_server.metrics = tiny_server.Metrics()
+    tiny_server.sourcetable_cache.clear()
+    with stub_caster.StubCaster() as caster, mock.patch.object(
+        tiny_server.sourcetable_cache, "ttl", 60
+    ), ThreadingHTTPServer(("127.0.0.1", 0), tiny_server.handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        for url in [caster.url, caster.url, "http://127.0.0.1:1"]:
+            request = urllib.request.Request(
+                base, json.dumps({"url": url}).encode(), method="POST"
+            )
+            try:
+                urllib.request.urlopen(request).read()
+            except urllib.error.HTTPError:
+                pass
+        # the handlers record a request after the client has read the response
+        for _ in range(100):
+            with urllib.request.urlopen(base + "/metrics") as response:
+                text = response.read().decode()
+            if 'status="502"} 1' in text:
+                break
+            time.sleep(0.01)
+        server.shutdown()
+
+    assert 'tiny_server_requests_total{method="POST",path="/",status="200"} 2' in text
+    assert 'tiny_server_requests_total{method="POST",path="/",status="502"} 1' in text
+    assert "tiny_server_requests_in_flight 1" in text  # the /metrics request
+    # 127.0.0.1 is not a catalog host
+    assert 'tiny_server_upstream_seconds_count{host="other"} 2' in text
+    assert 'tiny_server_upstream_errors_total{host="other",code="7"} 1' in text
+    assert "tiny_server_sourcetable_cache_hits_total 1" in text
+    assert 'tiny_server_response_bytes_bucket{path="/",le="+Inf"} 3' in text
+
+    assert tiny_server._metrics_host("http://NTRIP.data.gnss.ga.gov.au:443") == (
+        "ntrip.data.gnss.ga.gov.au"
+    )
+    metrics = tiny_server.Metrics()
+    metrics.upstream_fetched('a\\b"c\nd', 0.1, error_code=7)
+    text = metrics.render(tiny_server.sourcetable_cache.stats())
+    assert 'tiny_server_upstream_errors_total{host="a\\\\b\\"c\\nd",code="7"} 1' in text
+
+
+def test_tiny_server_shares_fetches():
+    release = threading.Event()
+
+    def fetch(url):
+        release.wait(5)
+        return ["STR;MP;"]
+
+    cache = tiny_server.sourcetable_cache
+    url = "http://caster.example.com:2101"
+    with mock.patch(server_path, side_effect=fetch) as fetched, ThreadingHTTPServer(
+        ("127.0.0.1", 0), tiny_server.handler
+    ) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+
+        def post():
+            request = urllib.request.Request(
+                base, json.dumps({"url": url}).encode(), method="POST"
+            )
+            with urllib.request.urlopen(request) as response:
+                return json.load(response)["content"]
+
+        coalesced = cache.stats()["coalesced"]
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(post())) for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        # all the requests are waiting on the fetch of the first one
+        for _ in range(500):
+            if cache.stats()["coalesced"] - coalesced == 4:
+                break
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert results == ["STR;MP;"] * 5
+        assert fetched.call_count == 1
+        # with the default cache_ttl, a later request fetches it again
+        post()
+        assert fetched.call_count == 2
+        server.shutdown()
+
+
+def test_curl_pool():
+    pool = ntrip_query.CurlPool()
+    curl = pool.curl()
+    assert pool.curl() is curl
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.curl()))
+    thread.start()
+    thread.join()
+    assert other[0] is not curl
+
+    with stub_caster.StubCaster(version="2", str_lines=500, gzip=True) as caster:
+        for _ in range(3):
+            lines = ntrip_query.get_streams_from_server(caster.url, pool)
+            assert ntrip_query.Sourcetable(lines).get("MP7").fields[2] == "Estación 7"
+        line = ntrip_query.get_str_line_streaming(caster.url, "MP7", pool)
+        assert line[1] == "MP7"
+        assert caster.compressed == 4
+
+
+def test_trajectory_resolver():
+    data = synthetic.synthetic_catalog(100, seed=8)
+    sourcetable = ntrip_query.Sourcetable(synthetic.synthetic_sourcetable(120, seed=8))
+    rng = random.Random(9)
+    fixes = evaluations = 0
+    for entry in data["entries"]:
+        url = entry["urls"][0]
+        mountpoint = f"MP{rng.randrange(110)}"
+        country = rng.choice([None, "DEU", "ESP"])
+        resolver = trajectory.TrajectoryResolver(
+            entry, url, mountpoint, country, sourcetable
+        )
+        lat, lon = rng.uniform(-80, 80), rng.uniform(-180, 180)
+        crs = None
+        for fix in range(1, 301):
+            lat = max(-90, min(90, lat + rng.gauss(0, 0.5)))
+            lon = lon + rng.gauss(0, 0.5)
+            change = resolver.update(lat, lon)
+            expected = ntrip_query.filter_crs(
+                entry, url, mountpoint, lat, lon, country, sourcetable
+            )
+            assert resolver.crs == expected
+            if fix == 1 or expected is not crs:
+                assert change == (fix, lat, ntrip_query.normalize_lon(lon), expected)
+            else:
+                assert change is None
+            crs = expected
+        fixes += resolver.fixes
+        evaluations += resolver.evaluations
+    assert evaluations < fixes / 4
+
+
+def test_parse_gga():
+    gga = "$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47"
+    lat, lon = trajectory.parse_gga(gga)
+    assert abs(lat - 48.1173) < 1e-9 and abs(lon - 11.516666666) < 1e-9
+    assert trajectory.parse_gga(gga[:-1] + "8") is None  # checksum
+    assert trajectory.parse_gga(gga.replace(",1,08,", ",0,08,")[:-3]) is None  # no fix
+    south_west = "$GNGGA,1,3345.5,S,07030.0,W,4,12,0.5,10,M,0,M,,"
+    assert trajectory.parse_gga(south_west) == (-33.758333333333336, -70.5)
+    assert trajectory.parse_gga("$GPRMC,123519,A,4807.038,N") is None
+
+    resolver = trajectory.TrajectoryResolver(
+        {"streams": [{"filter": "all", "crss": [{"id": "EPSG:7912"}]}]}, "", "MP"
+    )
+    changes = list(resolver.track_nmea(["garbage", gga, gga, south_west]))
+    assert changes == [(1, lat, lon, {"id": "EPSG:7912"})]
+    assert resolver.evaluations == 1
+
+
+def test_tiny_server_resolve():
+    with open("./tests/data/ign_es.json") as f:
+        mock_data = json.load(f)
+    tiny_server.sourcetable_cache.clear()
+    url = "http://ergnss-tr.ign.es:2102"
+    entry = ntrip_query.get_catalog().search_url(url)
+    expected = ntrip_query.filter_crs(
+        entry, url, "VCIA3M", 39.5, -0.4, None, mock_data[url]
+    )
+
+    with mock.patch(
+        server_path, side_effect=mock_data.__getitem__
+    ), ThreadingHTTPServer(("127.0.0.1", 0), tiny_server.handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}/resolve?"
+
+        def get(query, headers={}):
+            request = urllib.request.Request(base + query, headers=headers)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return response.status, response.headers, response.read()
+            except urllib.error.HTTPError as e:
+                return e.code, e.headers, e.read()
+
+        query = "url=ergnss-tr.ign.es&port=2102&mountpoint=VCIA3M&lat=39.5&lon=-0.4"
+        status, headers, body = get(query, {"Accept-Encoding": "gzip"})
+        assert status == 200 and headers["Content-Encoding"] == "gzip"
+        res = json.loads(gzip.decompress(body))
+        assert res["url"] == url and res["crs"] == expected
+        etag = headers["ETag"]
+        digest = ntrip_query.Sourcetable(mock_data[url]).digest
+        assert etag == f'W/"{res["release"]}-{digest}"'
+        assert headers["Cache-Control"] == "no-cache"
+
+        status, headers, body = get(query, {"If-None-Match": etag})
+        assert status == 304 and headers["ETag"] == etag and not body
+        status, _, body = get(query, {"If-None-Match": 'W/"0-other"'})
+        assert status == 200 and json.loads(body) == res
+
+        for query in ["mountpoint=VCIA3M", "url=ergnss-tr.ign.es&lat=39.5"]:
+            status, _, body = get(query)
+            assert status == 400 and "error" in json.loads(body)
+        status, _, body = get("url=unknown.example.com&lat=39.5&lon=-0.4")
+        assert status == 404
+        assert json.loads(body)["url"] == "http://unknown.example.com:2101"
+        server.shutdown()
+
+
+def test_tiny_server_resolve_fetches_lazily():
+    tiny_server.sourcetable_cache.clear()
+    params = {"url": "http://ntrip.reseau-orpheon.fr:8500", "lat": "45", "lon": "2"}
+    error = pycurl.error(pycurl.E_COULDNT_RESOLVE_HOST, "no network")
+    with mock.patch(server_path, side_effect=error):
+        # the stream filtered by mountpoint decides, the caster is not needed
+        status, res, etag = tiny_server.resolve_response(
+            {**params, "mountpoint": "RRAF91_i-MAX_3.0_GG"}
+        )
+        assert status == 200 and res["crs"]["name"] == "RRAF 1991"
+        assert etag == f'W/"{res["release"]}--"'
+        with pytest.raises(pycurl.error):
+            tiny_server.resolve_response({**params, "mountpoint": "OTHER"})
+
+
+def test_tiny_server_entry(tmp_path):
+    release = ntrip_query.get_catalog().release
+    status, res, etag = tiny_server.entry_response(
+        {"url": "ergnss-tr.ign.es", "port": "2101"}
+    )
+    assert status == 200 and etag == f'W/"{release}"'
+    assert res["url"] == "http://ergnss-tr.ign.es:2101"
+    assert res["url"] in res["entry"]["urls"]
+    status, res, _ = tiny_server.entry_response({"url": "HTTP://ERGNSS-TR.IGN.ES:2101"})
+    assert status == 200 and res["url"] == "http://ergnss-tr.ign.es:2101"
+    status, _, _ = tiny_server.entry_response(
+        {"url": "ergnss-tr.ign.es", "port": "2101", "https": "on"}
+    )
+    assert status == 404
+    assert tiny_server.entry_response({"url": ""})[0] == 400
+
+    # the full entry, that the search page shows, even next to compact artifacts
+    data = ntrip_query.load_json()
+    path = str(tmp_path / "ntrip-catalog.json")
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+    make_dist.write_compact(data, path)
+    holder = ntrip_query.CatalogHolder(path)
+    with mock.patch.object(tiny_server, "entry_catalog_holder", holder):
+        _, res, _ = tiny_server.entry_response({"url": "http://ergnss-tr.ign.es:2101"})
+    assert "description" in res["entry"] and "url" in res["entry"]["reference"]
+    assert res["entry"] == ntrip_query.Catalog(data).search_url(res["url"])
+
+    with ThreadingHTTPServer(("127.0.0.1", 0), tiny_server.handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        entry_url = f"http://127.0.0.1:{server.server_address[1]}/entry?"
+        entry_url += "url=ergnss-tr.ign.es&port=2101"
+        with urllib.request.urlopen(entry_url) as response:
+            assert response.headers["Cache-Control"] == "public, max-age=300"
+            assert response.headers["ETag"] == etag
+            assert json.load(response)["release"] == release
+        request = urllib.request.Request(entry_url, headers={"If-None-Match": etag})
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request)
+        assert error.value.code == 304
+        server.shutdown()
+
+
+def test_query_lazy_imports(tmp_path):
+    code = "import sys; from scripts import query; print(sorted(sys.modules))"
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ntrip_query.local_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert "'numpy'" not in output and "'pycurl'" not in output
+
+    # the shards next to the dist are used if they were written from it
+    data = synthetic.synthetic_catalog(20, release=7)
+    json_path = tmp_path / "ntrip-catalog.json"
+    json_path.write_text(json.dumps(data, indent=4))
+    assert ntrip_query.shards_manifest_for(json_path) is None
+    make_dist.write_shards(data, tmp_path / "shards")
+    assert ntrip_query.shards_manifest_for(json_path) is None
+    make_dist.write_shards(data, tmp_path / "shards", json_path)
+    manifest_path = ntrip_query.shards_manifest_for(json_path)
+    assert manifest_path == str(tmp_path / "shards" / "manifest.json")
+    with mock.patch("scripts.query.get_catalog") as get_catalog:
+        args = mock.Mock(shards_manifest=None, json_path=str(json_path))
+        entry = ntrip_query._entry_from_args(args, data["entries"][3]["urls"][0])
+        assert entry == data["entries"][3]
+        assert not get_catalog.called
+    # even if the release is the same
+    json_path.write_text(json.dumps({**data, "entries": data["entries"][:3]}))
+    assert ntrip_query.shards_manifest_for(json_path) is None
+
+
+def test_query_daemon(tmp_path):
+    mock_data = {}
+    for filename in ["./tests/data/ign_es.json", "./tests/data/vrsnow.de.json"]:
+        with open(filename) as f:
+            mock_data.update(json.load(f))
+    socket_path = str(tmp_path / "query.sock")
+
+    def query(url, port, mountpoint, lat=None, lon=None, country=None):
+        args = mock.Mock(
+            url=url,
+            port=port,
+            mountpoint=mountpoint,
+            rover_lat=lat,
+            rover_lon=lon,
+            rover_country=country,
+        )
+        return ntrip_query.query_daemon(args, socket_path)
+
+    with pytest.raises(OSError):
+        query("http://ergnss-tr.ign.es", 2101, "CERCANA3")
+
+    with mock.patch(
+        server_path, side_effect=mock_data.__getitem__
+    ) as mokked, query_daemon.QueryDaemon(socket_path) as daemon:
+        threading.Thread(target=daemon.serve_forever, daemon=True).start()
+        catalog = ntrip_query.get_catalog()
+        for row in [
+            ("http://ergnss-tr.ign.es", 2101, "CERCANA3", 40.0, -3.0),
+            ("ergnss-tr.ign.es", 2102, "IZAN3M", 28.3, -16.5),
+            ("http://ergnss-tr.ign.es:2102", None, "VCIA3M", 39.5, -0.4),
+            ("http://vrsnow.de:2101", None, "NET_MSM5", 47.0, 8.0, "CHE"),
+            ("http://vrsnow.de:2101", None, "NET_MSM5", 47.0, 8.0, "DEU"),
+            ("http://unknown.example.com", 2101, "MP"),
+            # decided by mountpoint, the caster is not in mock_data
+            ("http://ntrip.reseau-orpheon.fr:8500", None, "RRAF91_i-MAX_3.0_GG"),
+        ]:
+            row = row + (None,) * (6 - len(row))
+            url = ntrip_query.normalize_url(row[0], row[1])
+            entry = catalog.search_url(url)
+            expected = entry and ntrip_query.filter_crs(
+                entry, url, *row[2:], mock_data.get(url)
+            )
+            assert query(*row) == expected
+        # the sourcetables are fetched once, by the daemon
+        assert mokked.call_count == 2
+        with mock.patch("os.getuid", return_value=os.getuid() + 1):
+            with pytest.raises(PermissionError, match="another user"):
+                query("http://ergnss-tr.ign.es", 2101, "CERCANA3")
+        with pytest.raises(RuntimeError, match="float"):
+            query("http://ergnss-tr.ign.es", 2101, "CERCANA3", "north", -3.0)
+
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(socket_path)
+            with sock.makefile("rwb", buffering=0) as f:
+                f.write(b"STATS\n")
+                status, stats = f.readline().decode().split("\t")
+        assert status == "OK" and json.loads(stats)["misses"] == 2
+        daemon.shutdown()
+    assert not pathlib.Path(socket_path).exists()
+
+    def can_answer(*options):
+        argv = ["query.py", "--url", "ergnss-tr.ign.es", "--daemon", *options]
+        with mock.patch.object(sys, "argv", argv):
+            return ntrip_query._daemon_can_answer(ntrip_query.parse_args())
+
+    assert can_answer() and not can_answer("--no-daemon")
+    for options in [
+        ["--json-path", "ntrip-catalog.json"],
+        ["--offline"],
+        ["--max-age", "0"],
+        ["--stale", "60"],
+        ["--cache-dir", str(tmp_path)],
+        ["--no-streaming"],
+    ]:
+        assert not can_answer(*options)
+
+
+def test_catalog_holder(tmp_path, caplog):
+    data = ntrip_query.load_json(compact=False)
+    json_path = tmp_path / "ntrip-catalog.json"
+
+    def write(release, entries):
+        with open(json_path, "w") as f:
+            json.dump(dict(data, release=release, entries=entries), f, indent=4)
+        # as if written later, whatever the resolution of the file times
+        mtime = time.time() + release
+        os.utime(json_path, (mtime, mtime))
+
+    write(9, data["entries"][:1])
+    assert ntrip_query.get_catalog(str(json_path)).release == 9
+    write(10, data["entries"][:1])
+    # not the Catalog that get_catalog loaded before
+    holder = ntrip_query.CatalogHolder(str(json_path), interval=0.01)
+    old = holder.catalog
+    assert old.release == 10 and len(old) == 1
+    assert not holder.check()
+
+    url = data["entries"][1]["urls"][0]
+    write(11, data["entries"][:2])
+    with caplog.at_level(logging.INFO, logger=ntrip_query.__name__):
+        assert holder.check()
+    assert "release 10 -> 11" in caplog.text
+    assert holder.catalog.release == 11 and holder.catalog.search_url(url)
+    # a request on the old snapshot is not affected
+    assert old.release == 10 and not old.search_url(url)
+
+    write(9, data["entries"])
+    assert not holder.check()
+    with open(json_path, "w") as f:
+        f.write('{"release": 20, "entries": [')
+    assert not holder.check()
+    assert holder.catalog.release == 11 and holder.rejected == 2
+
+    with holder:
+        write(12, data["entries"])
+        for _ in range(500):
+            if holder.catalog.release == 12:
+                break
+            time.sleep(0.01)
+    assert holder.catalog.release == 12 and len(holder.catalog) == len(data["entries"])
+    assert holder.reloads == 2
@@ -238,6 +238,56 @@ function paramsToDic(location) {
     return dic;
 }
 
+// add &proxy=on to use the local proxy, web/tiny_server.py
+const LOCAL_PROXY_URL = "http://localhost:8010"
+
+function find_entry_in_dist(requested_url) {
+    return fetch('../dist/ntrip-catalog.json', {
+        method: "GET",
+    })
+    .then(response => response.json())
+    .then(data => {
+        g_data = data;
+        for (const entry of data.entries) {
+            for (const url of entry.urls) {
+                if (url == requested_url)
+                    return [entry, url];
+            }
+        }
+        return [null, null];
+    });
+}
+
+// Returns a promise of [entry, url], or [null, null] if not found.
+// The local proxy returns only the entry. Without it, or if it fails, the
+// whole catalog is downloaded and searched.
+function find_entry(params) {
+    const requested_url = (params.https ? "https" : "http") + "://" + params.url + ":" + params.port
+    if (!params['proxy'])
+        return find_entry_in_dist(requested_url);
+
+    let query = new URLSearchParams({"url": params.url, "port": params.port});
+    if (params.https)
+        query.set("https", "on");
+    return fetch(`${LOCAL_PROXY_URL}/entry?${query}`, {
+        method: "GET",
+    })
+    .then(response => {
+        if (response.status == 404)
+            return [null, null];
+        if (!response.ok)
+            throw new Error('Something went wrong getting the entry for ' + requested_url);
+        return response.json().then(json => {
+            console.log("release:", json.release, "url:", json.url);
+            return [json.entry, json.url];
+        });
+    })
+    .catch((error) => {
+        console.log(error, "Searching in the whole catalog.")
+        return find_entry_in_dist(requested_url);
+    });
+}
+
 function init_search() {
     const params = paramsToDic(window.location);
     function fill_value(key) {
@@ -247,78 +297,62 @@ function init_search() {
         ['url', 'port'].forEach(e => fill_value(e));
         ['https', 'proxy'].forEach(e => {if (params[e]) document.querySelector(`#${e}`).checked = true;})
 
-        fetch('../dist/ntrip-catalog.json', {
-            method: "GET",
-        })
-        .then(response => response.json())
-        .then(data => {
-            g_data = data;
-            let entry = null
-            const requested_url = (params.https ? "https" : "http") + "://" + params.url + ":" + params.port
-            for (let i = 0; i < data.entries.length && entry==null; i++) {
-                for (let j = 0; j < data.entries[i].urls.length; j++) {
-                    let url = data.entries[i].urls[j];
-                    if (url == requested_url) {
-                        entry = data.entries[i];
-                        g_entry = entry;
-                        g_url = url;
-                        document.querySelector('#entry_content').textContent = JSON.stringify(entry, null, 4);
-                        document.querySelector('#entry_name').textContent = entry.name;
-                        document.querySelector('#entry_description').textContent = entry.description;
-                        document.querySelector('#entry_ref').innerHTML = `<a href="${entry.reference.url}" target="_blank">${entry.reference.url}</a>`;
-
-                        ['mountpoint', 'country', 'latitude', 'longitude'].forEach(e => fill_value(e));
-                        if (document.querySelector('#mountpoint').textContent)
-                            document.querySelector('#crs_content').textContent = "... loading";
-
-                        const [country, latlon] = entry_needs_country_latlon(entry);
-                        document.querySelector(`#country`).required = country;
-                        document.querySelector(`#latitude`).required = latlon;
-                        document.querySelector(`#longitude`).required = latlon;
-
-                        // We do this request via this service to avoid CORS problems.
-                        // See that bumblebee is currently located in AWS, and some countries/services
-                        // may lock (or allow) those URLs
-                        let server_url = "https://api.webgis.pix4d.com/bumblebee/v0/ntrip/sourcetable"
-                        if (params['proxy']) {
-                            // add &proxy=on to use this local proxy
-                            server_url = "http://localhost:8010";
-                            console.log("Using", server_url)
-                        }
-                        fetch(server_url, {
-                            method: "POST",
-                            headers: {
-                                "accept": "application/json",
-                                "Content-Type": "application/json"
-                            },
-                            body: JSON.stringify({ "url": url })
-                        })
-                        .then((response) => {
-                            if (response.ok) {
-                                return response.json();
-                            }
-                            console.log(response)
-                            throw new Error('Something went wrong getting the soucetable for ' + url);
-                        })
-                        .then((json) => {
-                            console.log("release:", json.release, "url:", json.url);
-                            document.querySelector('#sourcetable_content').textContent = json.content;
-                            g_fetched_sourcetable = json;
-                            fill_mp_select(json);
-                            //const invalid = ['#mountpo'].find(v => !document.querySelector(m).checkValidity())
-                            if (document.querySelector('#mountpoint').checkValidity() && document.querySelector('#country').checkValidity())
-                                submit_details();
-                        })
-                        .catch((error) => {
-                            console.log(error)
-                            document.querySelector('#crs_content').textContent = "--- error ---"
-                            document.querySelector('#crs-not-ok').classList.remove("hidden");
-                        });
-                        break;
-                    }
-                }
-            }
+        find_entry(params)
+        .then(([entry, url]) => {
             if (entry) {
+                g_entry = entry;
+                g_url = url;
+                document.querySelector('#entry_content').textContent = JSON.stringify(entry, null, 4);
+                document.querySelector('#entry_name').textContent = entry.name;
+                document.querySelector('#entry_description').textContent = entry.description;
+                document.querySelector('#entry_ref').innerHTML = `<a href="${entry.reference.url}" target="_blank">${entry.reference.url}</a>`;
+
+                ['mountpoint', 'country', 'latitude', 'longitude'].forEach(e => fill_value(e));
+                if (document.querySelector('#mountpoint').textContent)
+                    document.querySelector('#crs_content').textContent = "... loading";
+
+                const [country, latlon] = entry_needs_country_latlon(entry);
+                document.querySelector(`#country`).required = country;
+                document.querySelector(`#latitude`).required = latlon;
+                document.querySelector(`#longitude`).required = latlon;
+
+                // We do this request via this service to avoid CORS problems.
+                // See that bumblebee is currently located in AWS, and some countries/services
+                // may lock (or allow) those URLs
+                let server_url = "https://api.webgis.pix4d.com/bumblebee/v0/ntrip/sourcetable"
+                if (params['proxy']) {
+                    server_url = LOCAL_PROXY_URL;
+                    console.log("Using", server_url)
+                }
+                fetch(server_url, {
+                    method: "POST",
+                    headers: {
+                        "accept": "application/json",
+                        "Content-Type": "application/json"
+                    },
+                    body: JSON.stringify({ "url": url })
+                })
+                .then((response) => {
+                    if (response.ok) {
+                        return response.json();
+                    }
+                    console.log(response)
+                    throw new Error('Something went wrong getting the soucetable for ' + url);
+                })
+                .then((json) => {
+                    console.log("release:", json.release, "url:", json.url);
+                    document.querySelector('#sourcetable_content').textContent = json.content;
+                    g_fetched_sourcetable = json;
+                    fill_mp_select(json);
+                    //const invalid = ['#mountpo'].find(v => !document.querySelector(m).checkValidity())
+                    if (document.querySelector('#mountpoint').checkValidity() && document.querySelector('#country').checkValidity())
+                        submit_details();
+                })
+                .catch((error) => {
+                    console.log(error)
+                    document.querySelector('#crs_content').textContent = "--- error ---"
+                    document.querySelector('#crs-not-ok').classList.remove("hidden");
+                });
                 document.querySelector('#url-ok').classList.remove("hidden");
             } else {
                 document.querySelector('#url-not-ok').classList.remove("hidden");
@@ -1,9 +1,17 @@
+import argparse
+import bisect
+import functools
+import gzip
 import json
 import logging
+import math
 import os
 import sys
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from sys import argv
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 try:
@@ -11,9 +19,177 @@ try:
 except Exception as e:
     raise e
 
+import pycurl  # noqa: E402
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PATHS = ("/", "/resolve", "/entry", "/metrics")
+
+
+def _label(value):
+    """Label value escaped for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=""):
+        sep = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    """
+    Counters of the server, rendered in the Prometheus text format by /metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)  # (method, path, status) -> count
+        self.in_flight = 0
+        self.response_bytes = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.upstream_seconds = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.upstream_errors = defaultdict(int)  # (host, pycurl code) -> count
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, method, path, status, nbytes):
+        if path not in PATHS:
+            path = "other"  # keep the label values bounded
+        with self._lock:
+            self.in_flight -= 1
+            self.requests[(method, path, status)] += 1
+            self.response_bytes[path].observe(nbytes)
+
+    def upstream_fetched(self, host, seconds, error_code=None):
+        with self._lock:
+            self.upstream_seconds[host].observe(seconds)
+            if error_code is not None:
+                self.upstream_errors[(host, error_code)] += 1
+
+    def render(self, cache_stats):
+        with self._lock:
+            lines = [
+                "# TYPE tiny_server_requests_total counter",
+                *(
+                    f'tiny_server_requests_total{{method="{_label(method)}",'
+                    f'path="{_label(path)}",status="{_label(status)}"}} {count}'
+                    for (method, path, status), count in sorted(self.requests.items())
+                ),
+                "# TYPE tiny_server_requests_in_flight gauge",
+                f"tiny_server_requests_in_flight {self.in_flight}",
+                "# TYPE tiny_server_response_bytes histogram",
+            ]
+            for path, histogram in sorted(self.response_bytes.items()):
+                lines += histogram.render(
+                    "tiny_server_response_bytes", f'path="{_label(path)}"'
+                )
+            lines.append("# TYPE tiny_server_upstream_seconds histogram")
+            for host, histogram in sorted(self.upstream_seconds.items()):
+                lines += histogram.render(
+                    "tiny_server_upstream_seconds", f'host="{_label(host)}"'
+                )
+            lines.append("# TYPE tiny_server_upstream_errors_total counter")
+            for (host, code), count in sorted(self.upstream_errors.items()):
+                lines.append(
+                    f'tiny_server_upstream_errors_total{{host="{_label(host)}",'
+                    f'code="{_label(code)}"}} {count}'
+                )
+        lookups = cache_stats["hits"] + cache_stats["misses"] + cache_stats["coalesced"]
+        # coalesced lookups did not fetch either
+        hit_ratio = (
+            (cache_stats["hits"] + cache_stats["coalesced"]) / lookups if lookups else 0
+        )
+        for key, kind in [
+            ("hits", "counter"),
+            ("misses", "counter"),
+            ("coalesced", "counter"),
+            ("evictions", "counter"),
+            ("entries", "gauge"),
+            ("bytes", "gauge"),
+        ]:
+            name = f"tiny_server_sourcetable_cache_{key}"
+            if kind == "counter":
+                name += "_total"
+            lines += [f"# TYPE {name} {kind}", f"{name} {cache_stats[key]}"]
+        lines += [
+            "# TYPE tiny_server_sourcetable_cache_hit_ratio gauge",
+            f"tiny_server_sourcetable_cache_hit_ratio {hit_ratio}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _metrics_host(url):
+    """
+    The host label of url: its hostname if it is in the catalog, or "other",
+    as clients can POST any url and the label values must stay bounded.
+    """
+    hostname = urlparse(url).hostname
+    if hostname and catalog_holder.catalog.search_host(hostname):
+        return hostname
+    return "other"
+
+
+def fetch_sourcetable(url):
+    """Fetches from the caster, recording the latency and errors per host."""
+    host = _metrics_host(url)
+    start = time.monotonic()
+    try:
+        lines = ntrip_query.get_streams_from_server(url)
+    except pycurl.error as e:
+        metrics.upstream_fetched(host, time.monotonic() - start, e.args[0])
+        raise
+    metrics.upstream_fetched(host, time.monotonic() - start)
+    return ntrip_query.Sourcetable(lines)
+
+
+# Reloaded when make_dist writes a new release, without losing the caches.
+# /resolve only needs the compact catalog, /entry serves the full entries.
+catalog_holder = ntrip_query.CatalogHolder(compact=True)
+entry_catalog_holder = ntrip_query.CatalogHolder()
+# Concurrent requests for the same url share one upstream fetch. The fetched
+# sourcetables are not reused afterwards, unless run with a cache_ttl.
+sourcetable_cache = ntrip_query.SourcetableCache(ttl=0, fetch=fetch_sourcetable)
+
+
+class _RequestSourcetable:
+    """
+    sourcetable_cache for the resolver of a request. It keeps the sourcetable
+    if the resolver used it.
+    """
+
+    def __init__(self):
+        self.sourcetable = None
+
+    def get(self, url):
+        self.sourcetable = sourcetable_cache.get(url)
+        return self.sourcetable
+
 
 def ntrip_response(url):
-    sourcetable_list = ntrip_query.get_streams_from_server(url)
+    sourcetable_list = sourcetable_cache.get(url)
     sourcetable = "\r\n".join(sourcetable_list)
     res = {
         "url": url,
@@ -24,14 +200,128 @@ def ntrip_response(url):
     return res
 
 
+def resolve_response(params):
+    """
+    Resolves the CRS for the query parameters of GET /resolve:
+    url (port is optional), mountpoint, lat, lon and country.
+    Returns (status, response, etag). The etag combines the catalog release
+    and the hash of the sourcetable, when the CRS depends on it.
+    """
+    if not params.get("url"):
+        return 400, {"error": "url is mandatory"}, None
+    try:
+        url = ntrip_query.normalize_url(params["url"], params.get("port"))
+        lat = float(params.get("lat", "nan"))
+        lon = float(params.get("lon", "nan"))
+    except ValueError as e:
+        return 400, {"error": str(e)}, None
+    if math.isnan(lat) != math.isnan(lon):
+        return 400, {"error": "lat and lon must be given together"}, None
+
+    catalog = catalog_holder.catalog
+    resolver = catalog.resolver(url)
+    if not resolver:
+        return 404, {"url": url, "error": "url not found in the catalog"}, None
+
+    # the sourcetable is fetched only if a stream filtered by the STR lines is
+    # reached before the CRS is decided
+    request_sourcetable = _RequestSourcetable()
+    crs = resolver.resolve(
+        url,
+        params.get("mountpoint"),
+        lat,
+        lon,
+        params.get("country") or None,
+        cache=request_sourcetable,
+    )
+    sourcetable = request_sourcetable.sourcetable
+    digest = sourcetable.digest if sourcetable else "-"
+    etag = f'W/"{catalog.release}-{digest}"'
+    res = {
+        "url": url,
+        "release": catalog.release,
+        "crs": crs,
+    }
+    return 200, res, etag
+
+
+def entry_response(params):
+    """
+    Returns the entry of the catalog for the query parameters of GET /entry:
+    url (with a scheme, or a hostname and https), and port.
+    Returns (status, response, etag). The etag is the catalog release.
+    """
+    url = params.get("url")
+    if not url:
+        return 400, {"error": "url is mandatory"}, None
+    if "://" not in url:
+        https = params.get("https", "").lower() not in ("", "0", "false", "off")
+        url = ("https://" if https else "http://") + url
+    try:
+        url = ntrip_query.normalize_url(url, params.get("port"))
+    except ValueError as e:
+        return 400, {"error": str(e)}, None
+
+    catalog = entry_catalog_holder.catalog
+    entry = catalog.search_url(url)
+    if not entry:
+        return 404, {"url": url, "error": "url not found in the catalog"}, None
+    # the url as written in the entry
+    url = next((u for u in entry["urls"] if ntrip_query.normalize_url(u) == url), url)
+    res = {
+        "url": url,
+        "release": catalog.release,
+        "entry": entry,
+    }
+    return 200, res, f'W/"{catalog.release}"'
+
+
+# path -> (function of the query parameters, Cache-Control of its responses)
+GET_ROUTES = {
+    # the CRS depends on the sourcetable, that can change at any time
+    "/resolve": (resolve_response, "no-cache"),
+    # the entry changes only with the catalog release
+    "/entry": (entry_response, "public, max-age=300"),
+}
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match or not etag:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def tracked(method):
+    """Records the request, its status and response size in the metrics."""
+
+    @functools.wraps(method)
+    def wrapper(self):
+        self.status = 0
+        self.nbytes = 0
+        metrics.request_started()
+        try:
+            method(self)
+        finally:
+            path = urlparse(self.path).path
+            metrics.request_finished(self.command, path, self.status, self.nbytes)
+
+    return wrapper
+
+
 class handler(BaseHTTPRequestHandler):
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "OPTIONS, POST")
+        self.send_header("Access-Control-Allow-Methods", "OPTIONS, GET, POST")
         self.send_header("Access-Control-Allow-Headers", "Content-Type")
         self.end_headers()
 
+    @tracked
     def do_POST(self):
         content_length = int(self.headers["Content-Length"])
         post_data = self.rfile.read(content_length)
@@ -41,7 +331,12 @@ class handler(BaseHTTPRequestHandler):
         logging.info(" POST request body: %s", post_data.decode("utf-8"))
 
         p = json.loads(post_data)
-        res = ntrip_response(p["url"])
+        try:
+            res = ntrip_response(p["url"])
+        except pycurl.error as e:
+            logging.error(" POST fetch failed: %s", e)
+            self.send_json(502, {"url": p["url"], "error": str(e)})
+            return
         message = json.dumps(res)
         msg_bytes = bytes(message, "utf8")
         logging.info(" POST response length: %d", len(msg_bytes))
@@ -52,16 +347,102 @@ class handler(BaseHTTPRequestHandler):
         self.send_header("Content-Length", str(len(msg_bytes)))
         self.end_headers()
         self.wfile.write(msg_bytes)
+        self.nbytes = len(msg_bytes)
+
+    @tracked
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/metrics":
+            self.send_metrics()
+            return
+        if parsed.path not in GET_ROUTES:
+            self.send_error(404)
+            return
+        response_function, cache_control = GET_ROUTES[parsed.path]
+        params = dict(parse_qsl(parsed.query))
+        logging.info(" GET %s: %s", parsed.path, params)
+        try:
+            status, res, etag = response_function(params)
+        except Exception as e:
+            logging.error(" %s failed: %s", parsed.path, e)
+            status, res, etag = 502, {"error": str(e)}, None
+
+        if status == 200 and etag_matches(self.headers["If-None-Match"], etag):
+            self.send_response(304)
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+            self.end_headers()
+            return
+        self.send_json(status, res, etag, cache_control)
+
+    def send_json(self, status, res, etag=None, cache_control="no-cache"):
+        msg_bytes = bytes(json.dumps(res), "utf8")
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        if gzipped:
+            msg_bytes = gzip.compress(msg_bytes)
+
+        self.send_response(status)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Content-type", "application/json")
+        self.send_header("Vary", "Accept-Encoding")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+        self.send_header("Content-Length", str(len(msg_bytes)))
+        self.end_headers()
+        self.wfile.write(msg_bytes)
+        self.nbytes = len(msg_bytes)
+
+    def send_metrics(self):
+        msg_bytes = metrics.render(sourcetable_cache.stats()).encode()
+        self.send_response(200)
+        self.send_header("Content-type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(msg_bytes)))
+        self.end_headers()
+        self.wfile.write(msg_bytes)
+        self.nbytes = len(msg_bytes)
 
 
-def run(port=8010):
-    with HTTPServer(("", port), handler) as server:
+def run(port=8010, cache_ttl=0, reload_interval=5):
+    sourcetable_cache.ttl = cache_ttl
+    catalog_holder.interval = reload_interval
+    entry_catalog_holder.interval = reload_interval
+    # loads them for /resolve and /entry, and watches for new releases
+    with catalog_holder, entry_catalog_holder, ThreadingHTTPServer(
+        ("", port), handler
+    ) as server:
         server.serve_forever()
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Local proxy to get the sourcetables of NTRIP servers."
+    )
+
+    parser.add_argument("port", type=int, nargs="?", default=8010)
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        help=(
+            "Seconds a fetched sourcetable is reused. By default it is not,"
+            " only the concurrent requests for the same url share one fetch"
+        ),
+        default=0,
+    )
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        help="Seconds between checks of the dist for a new release of the catalog",
+        default=5,
+    )
+
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    if len(argv) == 2:
-        run(port=int(argv[1]))
-    else:
-        run()
+    args = parse_args()
+    run(port=args.port, cache_ttl=args.cache_ttl, reload_interval=args.reload_interval)